@@ -3,10 +3,12 @@ import requests
 import os
 import json
 import logging
-from sqlalchemy import select, create_engine
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from models import auth_app
-from utils import encrypt
+from database import make_engine
+from token_crypto import encrypt
+from multivende_client import get_client
 
 try:
     import config
@@ -19,13 +21,13 @@ logging.basicConfig(format='%(asctime)s: %(message)s', stream=sys.stdout,
                     level=logging.INFO)
 
 # Making engine
-engine = create_engine(config.SQLALCHEMY_DATABASE_URI)
+engine = make_engine(config.SQLALCHEMY_DATABASE_URI)
 
 # Get teh authorization code from script call
 code = sys.argv[1]
 logger.info('Requesting access token.')
 # Definimos url de acceso
-url = "https://app.multivende.com/oauth/access-token"
+url = "/oauth/access-token"
 # Creamos la informacion a enviar
 payload = {
             "client_id": config.CLIENT_ID,
@@ -38,7 +40,7 @@ headers = {
         'cache-control': 'no-cache',
         'Content-Type': 'application/json'
 }
-response = requests.post(url, headers=headers, data=json.dumps(payload))
+response = get_client().post(url, headers=headers, data=json.dumps(payload))
 
 try:
     # Guardamos la informacion requerida y logueamos
@@ -0,0 +1,133 @@
+"""
+Benchmark de la transformación de un checkout del webhook: pandas vs checkout_parser.
+
+Compara, sobre el checkout sintético del benchmark de descarga:
+
+  * before: el armado original de `webhook_load_checkout` (dict + DataFrame de una
+    fila con pd.to_datetime, fillna, replace y df.loc).
+  * after:  `checkout_parser.parse_checkout` (Python puro, fromisoformat).
+
+Verifica además que ambas versiones producen el mismo row_hash para
+checkouts_full y checkout_items, es decir, las mismas filas en MySQL.
+
+Uso:
+    python benchmarks/bench_checkout_parser.py --iterations 2000
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np
+import pandas as pd
+from bench_checkouts_full_fetch import fake_checkout, FAKE_BILLING
+from checkout_parser import parse_checkout
+from utils import CHECKOUTS_FULL_FIELDS, CHECKOUT_ITEMS_FIELDS, _records, row_hash
+
+
+def pandas_transform(checkout, billing):
+    """Transformación original del webhook, sin la parte de red ni la escritura."""
+    tmp = {}
+    tmp["fecha"] = checkout["soldAt"]
+    tmp["nombre"] = checkout["Client"]["fullName"]
+    tmp["n venta"] = checkout["CheckoutLink"]["externalOrderNumber"]
+    tmp["id"] = checkout["CheckoutLink"]["CheckoutId"]
+    tmp["estado entrega"] = checkout["deliveryStatus"]
+    tmp["costo de envio"] = checkout["DeliveryOrderInCheckouts"][0]["DeliveryOrder"]["cost"]
+    tmp["market"] = checkout["origin"]
+    tmp["mail"] = checkout["Client"]["email"]
+    tmp["phone"] = checkout["Client"]["phoneNumber"]
+    try:
+        tmp["estado boleta"] = billing["entries"][-1]["ElectronicBillingDocumentFiles"][-1]["synchronizationStatus"]
+        tmp["url boleta"] = billing["entries"][-1]["ElectronicBillingDocumentFiles"][-1]["url"]
+    except Exception:
+        tmp["estado boleta"] = None
+        tmp["url boleta"] = None
+    tmp["estado venta"] = [status["paymentStatus"] for status in checkout["CheckoutPayments"]]
+    delivery = checkout['DeliveryOrderInCheckouts'][0]['DeliveryOrder']
+    if delivery['promisedDeliveryDate'] is None:
+        tmp['fecha promesa'] = '2262-04-11 23:47:16.854775Z'
+    else:
+        tmp['fecha promesa'] = delivery['promisedDeliveryDate']
+    try:
+        tmp['direccion'] = delivery['deliveryAddress'][0:79]
+    except (TypeError, KeyError, IndexError):
+        tmp['direccion'] = None
+    tmp['codigo'] = delivery['code']
+    tmp['courier'] = delivery['courierName']
+    tmp['clase de envio'] = delivery['shippingMode']
+    tmp['fecha despacho'] = delivery['handlingDateLimit']
+    tmp['delivery status'] = delivery['deliveryStatus']
+    n_seguimiento = delivery['trackingNumber']
+    if n_seguimiento and len(n_seguimiento) == 21:
+        tmp['N seguimiento'] = n_seguimiento[3:-7]
+    elif n_seguimiento is not None:
+        tmp['N seguimiento'] = n_seguimiento if len(n_seguimiento) != 36 else None
+    tmp['status etiqueta'] = delivery['shippingLabelStatus']
+    tmp['estado impresion etiqueta'] = delivery['shippingLabelPrintStatus']
+    tmp['id venta'] = checkout['_id']
+    tmp['codigo venta'] = checkout['code']
+    tmp['updated at'] = checkout.get('updatedAt')
+
+    productos = [{
+        "codigo producto": product["code"],
+        "nombre producto": product["ProductVersion"]["Product"]["name"],
+        "id padre producto": product["ProductVersion"]["ProductId"],
+        "id hijo producto": product["ProductVersionId"],
+        "cantidad": product["count"],
+        "precio": product["totalWithDiscount"],
+        "id venta": checkout["CheckoutLink"]["CheckoutId"],
+    } for product in checkout["CheckoutItems"]]
+
+    df = pd.DataFrame([tmp])
+    df["fecha"] = pd.to_datetime(df["fecha"]).dt.tz_convert(None)
+    df.fillna(np.nan, inplace=True)
+    df['courier'] = df['courier'].fillna('Empty')
+    df["fecha despacho"] = pd.to_datetime(df["fecha despacho"]).dt.tz_convert(None)
+    df["fecha promesa"] = pd.to_datetime(df["fecha promesa"]).dt.tz_convert(None)
+    df["updated at"] = pd.to_datetime(df["updated at"], utc=True).dt.tz_convert(None)
+    df = df.fillna(np.nan)
+    for i in df["estado venta"].index:
+        df.loc[i, "estado venta"] = df["estado venta"][i][-1]
+    df = df.replace({np.nan: None})
+    return df, productos
+
+
+def timed(fn, iterations):
+    st = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - st) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    checkout = fake_checkout("00000000-0000-0000-0000-000000000001")
+    checkout["updatedAt"] = "2025-01-10T12:30:00.000Z"
+
+    # Ambas versiones deben producir las mismas filas
+    df, productos = pandas_transform(checkout, FAKE_BILLING)
+    record = _records(df)[0]
+    before_row = {c: record.get(f) for c, f in CHECKOUTS_FULL_FIELDS.items()}
+    before_items = [{c: item.get(f) for c, f in CHECKOUT_ITEMS_FIELDS.items()} for item in productos]
+    row, items = parse_checkout(checkout, FAKE_BILLING)
+    same = (row_hash(before_row) == row_hash(row.as_dict())
+            and [row_hash(i) for i in before_items] == [row_hash(i.as_dict()) for i in items])
+
+    before = timed(lambda: pandas_transform(checkout, FAKE_BILLING), args.iterations)
+    after = timed(lambda: parse_checkout(checkout, FAKE_BILLING), args.iterations)
+
+    print(f"iterations={args.iterations} same rows={same}")
+    print(f"before (pandas)          : {before * 1e6:10.1f} us/checkout")
+    print(f"after  (checkout_parser) : {after * 1e6:10.1f} us/checkout")
+    print(f"speedup                  : {before / after:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Benchmark de la fase de descarga de update_checkouts_full.py contra un stub local.
+
+Levanta un servidor HTTP que imita los endpoints de Multivende usados por el job
+(listado light con scroll, detalle de checkout y documentos de facturación) y
+mide el tiempo de pared de una ventana de 5 días con:
+
+  * before: `requests.get` sin sesión, un handshake por request (código original).
+  * after:  `MultivendeClient` con pool keep-alive.
+  * after + workers: además, detalle por id con `fetch_many` (`--workers`).
+
+El stub agrega `--handshake-ms` de espera por cada conexión aceptada para
+simular el costo TCP+TLS contra app.multivende.com y `--latency-ms` por request
+para simular el tiempo de respuesta de la API; la escritura a MySQL queda fuera
+de la medición.
+
+Uso:
+    python benchmarks/bench_checkouts_full_fetch.py --checkouts 1000 --handshake-ms 30
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import requests
+from multivende_client import MultivendeClient, fetch_many
+
+MERCHANT_ID = "bench-merchant"
+SCROLL_PAGE = 500
+
+
+def fake_checkout(checkout_id):
+    return {
+        "_id": checkout_id,
+        "code": "C" + checkout_id[-6:],
+        "soldAt": "2025-01-10T12:00:00.000Z",
+        "deliveryStatus": "delivered",
+        "origin": "mercadolibre",
+        "Client": {"fullName": "Cliente Bench", "email": "bench@example.com", "phoneNumber": "123"},
+        "CheckoutLink": {"externalOrderNumber": "2000" + checkout_id[-6:], "CheckoutId": checkout_id},
+        "CheckoutPayments": [{"paymentStatus": "pending"}, {"paymentStatus": "completed"}],
+        "DeliveryOrderInCheckouts": [{"DeliveryOrder": {
+            "cost": 3990, "promisedDeliveryDate": "2025-01-12T12:00:00.000Z",
+            "deliveryAddress": "Av. Siempre Viva 742", "code": "D1", "courierName": "Chilexpress",
+            "shippingMode": "me2", "handlingDateLimit": "2025-01-11T12:00:00.000Z",
+            "deliveryStatus": "delivered", "trackingNumber": "123456789012345678901",
+            "shippingLabelStatus": "ready", "shippingLabelPrintStatus": "printed",
+        }}],
+        "CheckoutItems": [{
+            "code": "SKU-1", "count": 1, "totalWithDiscount": 19990, "ProductVersionId": "pv-1",
+            "ProductVersion": {"ProductId": "p-1", "Product": {"name": "Producto Bench"}},
+        }],
+    }
+
+
+FAKE_BILLING = {"entries": [{"ElectronicBillingDocumentFiles": [
+    {"synchronizationStatus": "synchronized", "url": "https://example.com/boleta.pdf"}]}]}
+
+
+def make_server(n_checkouts, handshake_ms, latency_ms):
+    ids = [f"00000000-0000-0000-0000-{i:012d}" for i in range(n_checkouts)]
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            time.sleep(latency_ms / 1000)
+            parsed = urlparse(self.path)
+            path = parsed.path
+            if "/checkouts/light/limit/" in path:
+                query = parse_qs(parsed.query)
+                start = int(query.get("_scroll_id", ["0"])[0])
+                limit = int(path.rsplit("/", 1)[-1])
+                chunk = ids[start:start + limit]
+                nxt = start + limit if start + limit < len(ids) else None
+                self._send({"entries": [{"_id": i} for i in chunk],
+                            "pagination": {"scroll_id": None if nxt is None else str(nxt)}})
+            elif path.endswith("/electronic-billing-documents/p/1"):
+                self._send(FAKE_BILLING)
+            elif path.startswith("/api/checkouts/"):
+                self._send(fake_checkout(path.rsplit("/", 1)[-1]))
+            else:
+                self.send_error(404)
+
+    class Server(ThreadingHTTPServer):
+        daemon_threads = True
+
+        def get_request(self):
+            conn = super().get_request()
+            # Simula el costo de establecer una conexión nueva (TCP + TLS)
+            time.sleep(handshake_ms / 1000)
+            return conn
+
+    return Server(("127.0.0.1", 0), Handler)
+
+
+def run_fetch(get, workers=1):
+    """Replica la fase de red del job: scroll de ids y detalle + boleta por id."""
+    url = f"/api/m/{MERCHANT_ID}/checkouts/light/limit/50?_sold_at_from=a&_sold_at_to=b"
+    response = get(url)
+    scroll_id = response["pagination"]["scroll_id"]
+    ids = [d["_id"] for d in response["entries"]]
+    while scroll_id is not None:
+        url = (f"/api/m/{MERCHANT_ID}/checkouts/light/limit/{SCROLL_PAGE}"
+               f"?_sold_at_from=a&_sold_at_to=b&_scroll_id={scroll_id}")
+        data = get(url)
+        scroll_id = data["pagination"]["scroll_id"]
+        ids += [d["_id"] for d in data["entries"]]
+
+    def detail(id):
+        get(f"/api/checkouts/{id}")
+        return get(f"/api/checkouts/{id}/electronic-billing-documents/p/1")
+
+    fetch_many(detail, ids, workers=workers)
+    return len(ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--checkouts", type=int, default=1000)
+    parser.add_argument("--handshake-ms", type=float, default=30.0)
+    parser.add_argument("--latency-ms", type=float, default=10.0)
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    server = make_server(args.checkouts, args.handshake_ms, args.latency_ms)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    headers = {"Authorization": "Bearer bench"}
+
+    st = time.time()
+    n = run_fetch(lambda path: requests.get(base_url + path, headers=headers).json())
+    before = time.time() - st
+
+    client = MultivendeClient("bench", base_url=base_url)
+    st = time.time()
+    run_fetch(client.get_json)
+    after = time.time() - st
+
+    st = time.time()
+    run_fetch(client.get_json, workers=args.workers)
+    concurrent = time.time() - st
+    client.close()
+    server.shutdown()
+
+    print(f"checkouts={n} requests={2 * n} handshake_ms={args.handshake_ms} latency_ms={args.latency_ms}")
+    print(f"before (requests.get)     : {before:8.2f} s")
+    print(f"after  (MultivendeClient) : {after:8.2f} s")
+    print(f"after  + {args.workers:2d} workers      : {concurrent:8.2f} s")
+    print(f"speedup (pool)            : {before / after:8.2f}x")
+    print(f"speedup (pool + workers)  : {before / concurrent:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Benchmark del tiempo de arranque (imports) de cada punto de entrada.
+
+Los jobs y novy_webhook.py ejecutan su trabajo al importarse, por lo que no se
+pueden importar directamente. Para cada entry point se extraen con `ast` sus
+imports de nivel superior y se ejecutan en un proceso nuevo con
+`python -X importtime`; el costo de arranque es la suma del tiempo acumulado de
+los módulos importados en primer nivel. Se toma el mínimo de `--repeat` corridas.
+
+Imprime el total por entry point y los módulos más pesados de cada uno. Con
+`--budget-ms` termina con código 1 si algún entry point supera el presupuesto,
+y con `--json` guarda los resultados para comparar entre versiones.
+
+Uso:
+    python benchmarks/bench_startup.py --repeat 5 --budget-ms 400
+"""
+
+import os
+import re
+import ast
+import sys
+import json
+import argparse
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+ENTRY_POINTS = [
+    "novy_webhook.py",
+    "update_token.py",
+    "authorize.py",
+    "update_checkouts_full.py",
+    "update_checkouts.py",
+    "update_deliveries.py",
+    "update_products.py",
+    "sync_products.py",
+    "update_ids.py",
+    "migrations.py",
+]
+
+LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+
+def import_header(path):
+    """Retorna el código de los imports de nivel superior de un script."""
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    nodes = [node for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))]
+    return "\n".join(ast.unparse(node) for node in nodes)
+
+
+def importtime(code):
+    """Corre `code` con -X importtime. Retorna {modulo de primer nivel: us acumulados}."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    modules = {}
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        # Solo los modulos importados directamente (sin indentacion)
+        if match and not match.group(3):
+            modules[match.group(4)] = int(match.group(2))
+    return modules
+
+
+def measure(entry_point, repeat):
+    code = import_header(os.path.join(ROOT, entry_point))
+    runs = [importtime(code) for _ in range(repeat)]
+    best = min(runs, key=lambda modules: sum(modules.values()))
+    return sum(best.values()), best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=5, help="modulos mas pesados a listar por entry point")
+    parser.add_argument("--budget-ms", type=float, default=None)
+    parser.add_argument("--json", default=None, help="archivo donde guardar los resultados")
+    parser.add_argument("entry_points", nargs="*", default=ENTRY_POINTS)
+    args = parser.parse_args()
+
+    results = {}
+    over_budget = []
+    for entry_point in args.entry_points:
+        try:
+            total, modules = measure(entry_point, args.repeat)
+        except RuntimeError as e:
+            print(f"{entry_point:28s} error: {e}")
+            continue
+        results[entry_point] = {"total_ms": total / 1000, "modules_ms": {m: us / 1000 for m, us in modules.items()}}
+        flag = ""
+        if args.budget_ms is not None and total / 1000 > args.budget_ms:
+            over_budget.append(entry_point)
+            flag = "  OVER BUDGET"
+        print(f"{entry_point:28s} {total / 1000:8.1f} ms{flag}")
+        for module, us in sorted(modules.items(), key=lambda item: -item[1])[:args.top]:
+            print(f"    {module:24s} {us / 1000:8.1f} ms")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if over_budget:
+        print(f"Sobre el presupuesto de {args.budget_ms} ms: {', '.join(over_budget)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
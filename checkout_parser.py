@@ -0,0 +1,245 @@
+"""
+checkout_parser.py — Transformación de checkouts de Multivende a registros
+
+Todos los jobs y el webhook extraen las filas de `checkouts_full`,
+`checkout_items` y `deliverys` de un checkout con este módulo, usando solo
+Python: las fechas se parsean con `datetime.fromisoformat` a datetime naive en
+UTC, los valores faltantes quedan como None (nunca NaN) y el estado de venta es
+el último pago.
+
+Cada tabla se describe con un mapa declarativo {columna: Field(ruta, conversión)}
+donde la ruta parte con el nombre de la fuente (`checkout`, `billing` o
+`product`) y sigue con llaves o índices separados por puntos. Al importar el
+módulo cada mapa se compila una sola vez en:
+
+  * una clase de registro con `__slots__` (un atributo por columna), y
+  * una función extractora generada que lee cada prefijo común de las rutas
+    (por ejemplo `DeliveryOrderInCheckouts[0]['DeliveryOrder']`) una sola vez.
+"""
+
+from collections import namedtuple
+from datetime import datetime, timezone
+
+# ruta: "fuente.llave.0.llave"; convert: función aplicada al valor;
+# optional: la última llave puede faltar (se usa .get)
+Field = namedtuple("Field", ["path", "convert", "optional"], defaults=(None, False))
+
+
+def parse_api_datetime(value):
+    """Convierte una fecha ISO 8601 de Multivende a datetime naive en UTC. None si es vacia."""
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        parsed = value
+    else:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def tracking_number(value):
+    """Normaliza el número de seguimiento del courier (None si no es informativo)."""
+    if value and len(value) == 21:
+        return value[3:-7]
+    if value is not None and len(value) != 36:
+        return value
+    return None
+
+
+def delivery_tracking_number(value):
+    """
+    Número de seguimiento de `deliverys`: solo el formato de 21 caracteres,
+    recortado (cabe en n_seguimiento, String(15)); cualquier otro es None.
+    """
+    if value and len(value) == 21:
+        return value[3:-7]
+    return None
+
+
+def last_payment_status(payments):
+    return payments[-1]["paymentStatus"] if payments else None
+
+
+def _billing_file(billing):
+    try:
+        return billing["entries"][-1]["ElectronicBillingDocumentFiles"][-1]
+    except (TypeError, KeyError, IndexError):
+        return {}
+
+
+def billing_status(billing):
+    return _billing_file(billing).get("synchronizationStatus")
+
+
+def billing_url(billing):
+    return _billing_file(billing).get("url")
+
+
+def address(value):
+    return value[0:79] if value else None
+
+
+def or_empty(value):
+    return value if value else "Empty"
+
+
+def _or_empty_if_none(value):
+    return value if value is not None else "Empty"
+
+
+class Record:
+    """Base de los registros compilados: un atributo por columna en `__slots__`."""
+
+    __slots__ = ()
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __iter__(self):
+        return (getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and tuple(self) == tuple(other)
+
+    def __repr__(self):
+        values = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({values})"
+
+
+def _split(path):
+    source, *keys = path.split(".")
+    return source, tuple(int(k) if k.lstrip("-").isdigit() else k for k in keys)
+
+
+def _access(expr, keys):
+    return expr + "".join(f"[{key!r}]" for key in keys)
+
+
+def compile_record(name, fields, sources):
+    """
+    Compila un mapa {columna: Field} en (clase de registro, extractor).
+
+    El extractor recibe las fuentes en el orden de `sources` y retorna una
+    instancia de la clase. El código se genera una vez: cada prefijo de ruta
+    usado por más de un campo se evalúa en una variable local.
+    """
+    columns = tuple(fields)
+    record = type(name, (Record,), {"__slots__": columns})
+    init = [f"def __init__(self, {', '.join(columns)}):"]
+    init += [f"    self.{column} = {column}" for column in columns]
+    namespace = {}
+    exec("\n".join(init), namespace)
+    record.__init__ = namespace["__init__"]
+
+    paths = {column: _split(field.path) for column, field in fields.items()}
+    parents = {}
+    for source, keys in paths.values():
+        parent = (source, keys[:-1])
+        parents[parent] = parents.get(parent, 0) + 1
+    hoisted = {parent: f"_p{i}" for i, parent in enumerate(p for p, n in parents.items() if n > 1 and p[1])}
+
+    body = [f"def extract({', '.join(sources)}):"]
+    body += [f"    {var} = {_access(source, keys)}" for (source, keys), var in hoisted.items()]
+    namespace = {"_Record": record}
+    args = []
+    for column, field in fields.items():
+        source, keys = paths[column]
+        parent = hoisted.get((source, keys[:-1])) or _access(source, keys[:-1])
+        if not keys:
+            expr = source
+        elif field.optional:
+            expr = f"{parent}.get({keys[-1]!r})"
+        else:
+            expr = f"{parent}[{keys[-1]!r}]"
+        if field.convert is not None:
+            namespace[f"_{column}"] = field.convert
+            expr = f"_{column}({expr})"
+        args.append(expr)
+    body.append(f"    return _Record({', '.join(args)})")
+    exec("\n".join(body), namespace)
+    return record, namespace["extract"]
+
+
+_DELIVERY = "checkout.DeliveryOrderInCheckouts.0.DeliveryOrder"
+
+# Columna de checkouts_full -> ruta en el checkout / boleta
+CHECKOUT_FIELDS = {
+    "costo_envio": Field(f"{_DELIVERY}.cost"),
+    "estado_boleta": Field("billing", billing_status),
+    "estado_entrega": Field("checkout.deliveryStatus"),
+    "estado_venta": Field("checkout.CheckoutPayments", last_payment_status),
+    "fecha": Field("checkout.soldAt", parse_api_datetime),
+    "mail": Field("checkout.Client.email"),
+    "market": Field("checkout.origin"),
+    "n_venta": Field("checkout.CheckoutLink.externalOrderNumber"),
+    "nombre_cliente": Field("checkout.Client.fullName"),
+    "phone": Field("checkout.Client.phoneNumber"),
+    "url_boleta": Field("billing", billing_url),
+    "n_seguimiento": Field(f"{_DELIVERY}.trackingNumber", tracking_number),
+    "codigo": Field(f"{_DELIVERY}.code"),
+    "codigo_venta": Field("checkout.code"),
+    "courier": Field(f"{_DELIVERY}.courierName", _or_empty_if_none),
+    "clase_de_envio": Field(f"{_DELIVERY}.shippingMode"),
+    "delivery_status": Field(f"{_DELIVERY}.deliveryStatus"),
+    "direccion": Field(f"{_DELIVERY}.deliveryAddress", address, optional=True),
+    "impresion_etiqueta": Field(f"{_DELIVERY}.shippingLabelPrintStatus"),
+    "fecha_despacho": Field(f"{_DELIVERY}.handlingDateLimit", parse_api_datetime),
+    "fecha_promesa": Field(f"{_DELIVERY}.promisedDeliveryDate", parse_api_datetime),
+    "id_venta": Field("checkout._id"),
+    "status_etiqueta": Field(f"{_DELIVERY}.shippingLabelStatus"),
+    "updated_at": Field("checkout.updatedAt", parse_api_datetime, optional=True),
+}
+
+# Columna de checkout_items -> ruta en el item (product) / checkout
+ITEM_FIELDS = {
+    "codigo_producto": Field("product.code"),
+    "nombre_producto": Field("product.ProductVersion.Product.name"),
+    "id_padre_producto": Field("product.ProductVersion.ProductId"),
+    "id_hijo_producto": Field("product.ProductVersionId"),
+    "cantidad": Field("product.count"),
+    "precio": Field("product.totalWithDiscount"),
+    "id_venta": Field("checkout.CheckoutLink.CheckoutId"),
+}
+
+# Columna de deliverys -> ruta en el checkout
+DELIVERY_FIELDS = {
+    "n_seguimiento": Field(f"{_DELIVERY}.trackingNumber", delivery_tracking_number),
+    "codigo": Field(f"{_DELIVERY}.code"),
+    "codigo_venta": Field("checkout.code"),
+    "courier": Field(f"{_DELIVERY}.courierName", _or_empty_if_none),
+    "clase_de_envio": Field(f"{_DELIVERY}.shippingMode", or_empty),
+    "delivery_status": Field(f"{_DELIVERY}.deliveryStatus"),
+    "direccion": Field(f"{_DELIVERY}.deliveryAddress", address, optional=True),
+    "impresion_etiqueta": Field(f"{_DELIVERY}.shippingLabelPrintStatus"),
+    "fecha_despacho": Field(f"{_DELIVERY}.handlingDateLimit", parse_api_datetime),
+    "fecha_promesa": Field(f"{_DELIVERY}.promisedDeliveryDate", parse_api_datetime),
+    "id_venta": Field("checkout._id"),
+    "status_etiqueta": Field(f"{_DELIVERY}.shippingLabelStatus"),
+    "n_venta": Field("checkout.CheckoutLink.externalOrderNumber"),
+}
+
+CheckoutRecord, _extract_checkout = compile_record("CheckoutRecord", CHECKOUT_FIELDS, ("checkout", "billing"))
+ItemRecord, _extract_item = compile_record("ItemRecord", ITEM_FIELDS, ("product", "checkout"))
+DeliveryRecord, _extract_delivery = compile_record("DeliveryRecord", DELIVERY_FIELDS, ("checkout",))
+
+
+def parse_checkout(checkout, billing=None):
+    """
+    Transforma un checkout de Multivende en registros.
+
+    Args:
+        checkout: JSON de /api/checkouts/{id}.
+        billing: JSON de .../electronic-billing-documents/p/1 (opcional).
+
+    Returns:
+        (CheckoutRecord, [ItemRecord]). Lanza KeyError/IndexError si el checkout
+        no tiene la estructura esperada.
+    """
+    return (_extract_checkout(checkout, billing),
+            [_extract_item(product, checkout) for product in checkout["CheckoutItems"]])
+
+
+def parse_delivery(checkout):
+    """Transforma un checkout en el DeliveryRecord de su despacho."""
+    return _extract_delivery(checkout)
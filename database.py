@@ -0,0 +1,135 @@
+"""
+database.py — Engine y sesiones compartidas por proceso
+
+Todos los jobs, el webhook y utils.py obtienen el engine con `get_engine()`, que
+lo crea la primera vez que se pide y luego lo reutiliza, de modo que cada proceso
+mantiene un solo pool de conexiones a MySQL. La creación es perezosa para que
+cada worker de gunicorn arme su propio pool después del fork.
+
+Variables de entorno:
+    DB_POOL_SIZE       conexiones que el pool mantiene abiertas (default 5)
+    DB_MAX_OVERFLOW    conexiones extra permitidas en picos (default 10)
+    DB_POOL_RECYCLE    segundos antes de reciclar una conexión (default 3600)
+    DB_POOL_TIMEOUT    segundos de espera por una conexión libre (default 30)
+
+Cada proceso puede abrir hasta DB_POOL_SIZE + DB_MAX_OVERFLOW conexiones, por lo
+que workers de gunicorn * (DB_POOL_SIZE + DB_MAX_OVERFLOW) + jobs concurrentes
+debe quedar bajo `max_connections` de MySQL.
+
+`advisory_lock(name)` coordina procesos distintos (jobs, workers del webhook)
+con un lock con nombre: GET_LOCK de MySQL o, en otros motores, flock local.
+"""
+
+import os
+import time
+import threading
+import tempfile
+from contextlib import contextmanager
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+from dotenv import load_dotenv
+load_dotenv()
+
+SQLALCHEMY_DATABASE_URI = os.getenv("SQLALCHEMY_DATABASE_URI")
+DB_SSL_CA = os.getenv("ssl")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "3600"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+
+_engine = None
+_session_factory = None
+_lock = threading.Lock()
+
+
+def make_engine(url=None, **kwargs):
+    """Crea un engine nuevo con la configuración de pool del entorno."""
+    options = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_pre_ping": True,
+    }
+    if DB_SSL_CA:
+        options["connect_args"] = {"ssl_ca": DB_SSL_CA}
+    options.update(kwargs)
+    return create_engine(url or SQLALCHEMY_DATABASE_URI, **options)
+
+
+def get_engine():
+    """Retorna el engine del proceso, creándolo en la primera llamada."""
+    global _engine
+    if _engine is None:
+        with _lock:
+            if _engine is None:
+                _engine = make_engine()
+    return _engine
+
+
+def get_session():
+    """Retorna una Session nueva ligada al engine del proceso."""
+    global _session_factory
+    if _session_factory is None:
+        with _lock:
+            if _session_factory is None:
+                _session_factory = sessionmaker(bind=get_engine())
+    return _session_factory()
+
+
+@contextmanager
+def advisory_lock(name, timeout=30, engine=None):
+    """
+    Lock con nombre compartido entre procesos.
+
+    En MySQL usa GET_LOCK/RELEASE_LOCK sobre una conexión dedicada, que lo libera
+    también si el proceso muere. En otros motores usa flock sobre un archivo en el
+    directorio temporal (solo coordina procesos del mismo host). Lanza
+    TimeoutError si el lock no se obtiene en `timeout` segundos.
+    """
+    engine = engine or get_engine()
+    if engine.dialect.name == "mysql":
+        with engine.connect() as conn:
+            acquired = conn.scalar(text("SELECT GET_LOCK(:name, :timeout)"), {"name": name, "timeout": timeout})
+            if acquired != 1:
+                raise TimeoutError(f"No se obtuvo el lock {name} en {timeout} s")
+            try:
+                yield
+            finally:
+                conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": name})
+        return
+
+    import fcntl
+    with open(os.path.join(tempfile.gettempdir(), f"{name}.lock"), "w") as lock_file:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    raise TimeoutError(f"No se obtuvo el lock {name} en {timeout} s")
+                time.sleep(0.1)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def pool_stats():
+    """Estado del pool del proceso, para dimensionar workers contra max_connections."""
+    stats = {
+        "pid": os.getpid(),
+        "initialized": _engine is not None,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+    }
+    if _engine is not None:
+        pool = _engine.pool
+        stats.update({
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": pool.overflow(),
+            "status": pool.status(),
+        })
+    return stats
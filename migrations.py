@@ -0,0 +1,172 @@
+"""
+migrations.py — Migraciones versionadas del esquema MySQL
+
+Cada migración es una tupla (version, descripcion, pasos). Un paso puede ser
+una sentencia SQL o una función que recibe la conexión. Las versiones aplicadas
+quedan registradas en la tabla `schema_migrations`, por lo que `upgrade` solo
+ejecuta las pendientes y es seguro correrlo en cada despliegue.
+
+Uso:
+    python migrations.py upgrade   # aplica las migraciones pendientes
+    python migrations.py status    # lista migraciones aplicadas y pendientes
+    python migrations.py check     # EXPLAIN de las consultas de los jobs, marca full scans
+"""
+
+import sys
+import logging
+from datetime import datetime
+from sqlalchemy import select, text
+from models import schema_migrations, sync_state, supabase_outbox
+from database import get_engine
+
+# Setting up logger
+logger = logging.getLogger(__name__)
+logging.basicConfig(format='%(asctime)s: %(message)s', stream=sys.stdout,
+                    level=logging.INFO)
+
+
+def _create_table(model):
+    return lambda conn: model.__table__.create(conn, checkfirst=True)
+
+
+MIGRATIONS = [
+    (1, "Tabla sync_state con watermarks de sincronizacion por job", [
+        _create_table(sync_state),
+    ]),
+    (2, "Columna checkouts_full.updated_at con el updatedAt de Multivende", [
+        "ALTER TABLE checkouts_full ADD COLUMN updated_at DATETIME NULL",
+    ]),
+    (3, "Llave unica checkouts_full.id_venta para upserts en lote", [
+        # Elimina duplicados historicos conservando la fila mas reciente
+        """DELETE c1 FROM checkouts_full c1
+           JOIN checkouts_full c2 ON c1.id_venta = c2.id_venta AND c1.id < c2.id""",
+        "ALTER TABLE checkouts_full ADD UNIQUE KEY uq_checkouts_full_id_venta (id_venta)",
+    ]),
+    (4, "Llave unica checkout_items (id_venta, id_hijo_producto) para upserts en lote", [
+        """DELETE i1 FROM checkout_items i1
+           JOIN checkout_items i2 ON i1.id_venta = i2.id_venta
+            AND i1.id_hijo_producto = i2.id_hijo_producto AND i1.id < i2.id""",
+        "ALTER TABLE checkout_items ADD UNIQUE KEY uq_checkout_items_venta_hijo (id_venta, id_hijo_producto)",
+    ]),
+    (5, "Columna row_hash para omitir escrituras sin cambios", [
+        "ALTER TABLE checkouts_full ADD COLUMN row_hash CHAR(40) NULL",
+        "ALTER TABLE checkout_items ADD COLUMN row_hash CHAR(40) NULL",
+        "ALTER TABLE deliverys ADD COLUMN row_hash CHAR(40) NULL",
+        "ALTER TABLE products ADD COLUMN row_hash CHAR(40) NULL",
+    ]),
+    (6, "Llave unica products (id_padre, id_hijo) para upserts en lote", [
+        # Los vinculos de atributos de las versiones duplicadas se borran antes por la FK
+        """DELETE a FROM association_table a
+           JOIN products p1 ON a.id_product = p1.id
+           JOIN products p2 ON p1.id_padre = p2.id_padre
+            AND p1.id_hijo = p2.id_hijo AND p1.id < p2.id""",
+        """DELETE p1 FROM products p1
+           JOIN products p2 ON p1.id_padre = p2.id_padre
+            AND p1.id_hijo = p2.id_hijo AND p1.id < p2.id""",
+        "ALTER TABLE products ADD UNIQUE KEY uq_products_padre_hijo (id_padre, id_hijo)",
+    ]),
+    # products.id_padre (soft delete) queda cubierto por el prefijo de uq_products_padre_hijo
+    (7, "Indices checkouts_full.fecha, deliverys (id_venta, n_venta) y auth.expire", [
+        "ALTER TABLE checkouts_full ADD INDEX ix_checkouts_full_fecha (fecha)",
+        """DELETE d1 FROM deliverys d1
+           JOIN deliverys d2 ON d1.id_venta = d2.id_venta
+            AND d1.n_venta = d2.n_venta AND d1.id < d2.id""",
+        "ALTER TABLE deliverys ADD UNIQUE KEY uq_deliverys_venta_n_venta (id_venta, n_venta)",
+        "ALTER TABLE auth ADD INDEX ix_auth_expire (expire)",
+    ]),
+    (8, "Tabla supabase_outbox para el dual-write a Supabase", [
+        _create_table(supabase_outbox),
+    ]),
+]
+
+# Consultas frecuentes de los jobs como (job, sql); `check` corre EXPLAIN sobre cada una
+HOT_QUERIES = [
+    ("update_checkouts_full", "SELECT id_venta, updated_at FROM checkouts_full WHERE id_venta IN ('a', 'b')"),
+    ("update_checkouts_full", "SELECT id_venta, row_hash FROM checkouts_full WHERE id_venta IN ('a', 'b')"),
+    ("update_checkouts_full", "SELECT id_venta, id_hijo_producto, row_hash FROM checkout_items "
+                              "WHERE (id_venta, id_hijo_producto) IN (('a', 'b'), ('c', 'd'))"),
+    ("reportes", "SELECT id_venta FROM checkouts_full WHERE fecha BETWEEN '2025-01-01' AND '2025-01-02'"),
+    ("update_deliveries", "SELECT id_venta, n_venta, row_hash FROM deliverys "
+                          "WHERE (id_venta, n_venta) IN (('a', '1'), ('b', '2'))"),
+    ("update_products", "SELECT id, id_padre, id_hijo, row_hash FROM products "
+                        "WHERE (id_padre, id_hijo) IN (('a', 'b'), ('c', 'd'))"),
+    ("update_products", "SELECT id_product, id_atributo FROM association_table WHERE id_product IN (1, 2)"),
+    ("sync_products", "SELECT id FROM products WHERE id_padre IN ('a', 'b')"),
+    ("token", "SELECT id, token, expire FROM auth ORDER BY expire DESC LIMIT 1"),
+    ("supabase_outbox", "SELECT id, id_venta, payload, attempts FROM supabase_outbox "
+                        "WHERE next_attempt_at <= '2025-01-01' ORDER BY id LIMIT 200"),
+]
+
+
+def applied_versions(conn):
+    """Retorna el set de versiones ya aplicadas, creando la tabla de control si falta."""
+    schema_migrations.__table__.create(conn, checkfirst=True)
+    return set(conn.scalars(select(schema_migrations.version)).all())
+
+
+def upgrade(engine):
+    """Aplica en orden las migraciones pendientes. Retorna las versiones aplicadas."""
+    with engine.begin() as conn:
+        done = applied_versions(conn)
+    applied = []
+    for version, description, steps in MIGRATIONS:
+        if version in done:
+            continue
+        logger.info(f"Aplicando migracion {version}: {description}")
+        with engine.begin() as conn:
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(text(step))
+            conn.execute(schema_migrations.__table__.insert().values(
+                version=version, description=description, applied_at=datetime.now()))
+        applied.append(version)
+    logger.info(f"Migraciones aplicadas: {len(applied)}")
+    return applied
+
+
+def status(engine):
+    """Imprime el estado de cada migracion."""
+    with engine.begin() as conn:
+        done = applied_versions(conn)
+    for version, description, _ in MIGRATIONS:
+        state = "aplicada" if version in done else "pendiente"
+        print(f"{version:04d} [{state}] {description}")
+
+
+def check(engine):
+    """
+    Corre EXPLAIN sobre HOT_QUERIES e imprime el plan de cada tabla.
+
+    Marca como FULL SCAN los planes con type=ALL. Retorna la cantidad de
+    consultas marcadas.
+    """
+    flagged = 0
+    with engine.connect() as conn:
+        for job, query in HOT_QUERIES:
+            plan = conn.execute(text(f"EXPLAIN {query}")).mappings().all()
+            full_scan = any(row["type"] == "ALL" for row in plan)
+            flagged += full_scan
+            for row in plan:
+                state = "FULL SCAN" if row["type"] == "ALL" else "ok"
+                print(f"[{state:9s}] {job}: {row['table']} type={row['type']} "
+                      f"key={row['key']} rows={row['rows']}")
+            if full_scan:
+                print(f"            {query}")
+    print(f"Consultas con full scan: {flagged}/{len(HOT_QUERIES)}")
+    return flagged
+
+
+if __name__ == "__main__":
+    engine = get_engine()
+    command = sys.argv[1] if len(sys.argv) > 1 else "status"
+    if command == "upgrade":
+        upgrade(engine)
+    elif command == "status":
+        status(engine)
+    elif command == "check":
+        sys.exit(1 if check(engine) else 0)
+    else:
+        print(__doc__)
+        sys.exit(1)
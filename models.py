@@ -1,5 +1,5 @@
 import sqlalchemy.orm as db
-from sqlalchemy import Boolean, Column, Integer, Text, DateTime, String, Float, ForeignKey, Table
+from sqlalchemy import Boolean, Column, Integer, Text, DateTime, String, Float, ForeignKey, Table, UniqueConstraint, Index
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 
@@ -9,6 +9,7 @@ class Base(db.DeclarativeBase):
 
 class auth_app(Base):
     __tablename__ = "auth"
+    __table_args__ = (Index("ix_auth_expire", "expire"),)
     id = Column(Integer, primary_key=True)
     token = Column(Text, nullable=False)
     expire = Column(DateTime, nullable=False)
@@ -16,6 +17,7 @@ class auth_app(Base):
 
 class checkout_items(Base):
     __tablename__ = "checkout_items"
+    __table_args__ = (UniqueConstraint("id_venta", "id_hijo_producto", name="uq_checkout_items_venta_hijo"),)
     id = Column(Integer, nullable=False, primary_key=True)
     codigo_producto = Column(String(36))
     nombre_producto = Column(String(120), nullable=False)
@@ -24,6 +26,7 @@ class checkout_items(Base):
     cantidad = Column(Integer, nullable=False)
     precio = Column(Integer, nullable=False)
     id_venta = Column(String(36), nullable=False)
+    row_hash = Column(String(40))
 
 
 class checkouts(Base):
@@ -51,6 +54,8 @@ class checkouts(Base):
 
 class checkouts_full(Base):
     __tablename__ = "checkouts_full"
+    __table_args__ = (UniqueConstraint("id_venta", name="uq_checkouts_full_id_venta"),
+                      Index("ix_checkouts_full_fecha", "fecha"))
     id = Column(Integer, nullable=False, primary_key=True)
     costo_envio = Column(Float, nullable=False)
     estado_boleta = Column(String(16))
@@ -76,10 +81,13 @@ class checkouts_full(Base):
     fecha_promesa = Column(DateTime)
     id_venta = Column(String(36), nullable=False)
     status_etiqueta = Column(String(5), nullable=False)
+    updated_at = Column(DateTime)
+    row_hash = Column(String(40))
 
 
 class deliverys(Base):
     __tablename__ = "deliverys"
+    __table_args__ = (UniqueConstraint("id_venta", "n_venta", name="uq_deliverys_venta_n_venta"),)
     id = Column(Integer, nullable=False, primary_key=True)
     n_seguimiento = Column(String(15), nullable=False)
     codigo = Column(String(15), nullable=False)
@@ -94,6 +102,31 @@ class deliverys(Base):
     id_venta = Column(String(36), nullable=False)
     status_etiqueta = Column(String(5), nullable=False)
     n_venta = Column(String(24))
+    row_hash = Column(String(40))
+
+class sync_state(Base):
+    __tablename__ = "sync_state"
+    job = Column(String(64), nullable=False, primary_key=True)
+    watermark = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+
+class supabase_outbox(Base):
+    __tablename__ = "supabase_outbox"
+    __table_args__ = (Index("ix_supabase_outbox_next_attempt", "next_attempt_at"),
+                      Index("ix_supabase_outbox_id_venta", "id_venta"))
+    id = Column(Integer, nullable=False, primary_key=True)
+    id_venta = Column(String(36), nullable=False)
+    payload = Column(Text, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False)
+    last_error = Column(Text)
+    created_at = Column(DateTime, nullable=False)
+
+class schema_migrations(Base):
+    __tablename__ = "schema_migrations"
+    version = Column(Integer, nullable=False, primary_key=True, autoincrement=False)
+    description = Column(String(255), nullable=False)
+    applied_at = Column(DateTime, nullable=False)
 
 class ids(Base):
     __tablename__ = "ids"
@@ -120,6 +153,7 @@ class Attributes(Base):
 
 class Product(Base):
     __tablename__ = 'products'
+    __table_args__ = (UniqueConstraint("id_padre", "id_hijo", name="uq_products_padre_hijo"),)
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     id_padre: Mapped[str] = mapped_column(String(36))
@@ -166,6 +200,7 @@ class Product(Base):
     CBarra06: Mapped[str] = mapped_column(String(24), nullable=True)
     Costo01: Mapped[float] = mapped_column(Float, nullable=True)
     active: Mapped[bool] = mapped_column(Boolean, nullable=True)
+    row_hash: Mapped[str] = mapped_column(String(40), nullable=True)
 
     attributes = relationship('Attributes', secondary = 'association_table')
 
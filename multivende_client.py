@@ -0,0 +1,362 @@
+"""
+multivende_client.py — Cliente HTTP compartido para la API de Multivende
+
+Todas las llamadas a app.multivende.com pasan por un único `MultivendeClient`,
+que mantiene un pool de conexiones keep-alive (evita un handshake TCP+TLS por
+request), aplica timeouts por tipo de endpoint, pide respuestas comprimidas y
+concentra en un solo lugar los headers de autenticación.
+
+El cliente incluye un `RateLimiter` (token bucket) que ajusta la tasa de
+requests según las respuestas de la API: baja a la mitad ante un 429 o cuando
+los headers de rate limit indican que queda poca cuota, y sube de a poco
+mientras las llamadas resultan exitosas.
+"""
+
+import os
+import re
+import time
+import logging
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+# --- Configuración ---
+MULTIVENDE_URL = os.getenv("MULTIVENDE_URL", "https://app.multivende.com").rstrip("/")
+MULTIVENDE_POOL_SIZE = int(os.getenv("MULTIVENDE_POOL_SIZE", "20"))
+MULTIVENDE_WORKERS = int(os.getenv("MULTIVENDE_WORKERS", "8"))
+# Tasa de requests por segundo (inicial, mínima y máxima) y reintentos ante 429
+MULTIVENDE_RATE = float(os.getenv("MULTIVENDE_RATE", "20"))
+MULTIVENDE_MIN_RATE = float(os.getenv("MULTIVENDE_MIN_RATE", "0.5"))
+MULTIVENDE_MAX_RATE = float(os.getenv("MULTIVENDE_MAX_RATE", "100"))
+MULTIVENDE_MAX_RETRIES = int(os.getenv("MULTIVENDE_MAX_RETRIES", "5"))
+
+# Timeouts (connect, read) en segundos por familia de endpoint
+DEFAULT_TIMEOUTS = {
+    "default": (5, 30),
+    "oauth": (5, 20),
+    "checkout": (5, 15),
+    "billing": (5, 10),
+    "listing": (5, 60),
+}
+
+# Orden importa: el primer patrón que calza define el endpoint
+_ENDPOINT_PATTERNS = [
+    ("oauth", re.compile(r"^/oauth/")),
+    ("billing", re.compile(r"/electronic-billing-documents")),
+    ("listing", re.compile(r"/(light|limit|p)/")),
+    ("checkout", re.compile(r"^/api/checkouts/")),
+]
+
+
+def _parse_seconds(value, now=None):
+    """
+    Interpreta un header de espera (Retry-After / *-Reset) y retorna segundos.
+
+    Acepta segundos relativos, epoch en segundos o una fecha HTTP. Retorna None
+    si el valor no se puede interpretar.
+    """
+    if value is None:
+        return None
+    now = time.time() if now is None else now
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            from email.utils import parsedate_to_datetime
+            return max(0.0, parsedate_to_datetime(value).timestamp() - now)
+        except (TypeError, ValueError):
+            return None
+    # Valores grandes son un epoch absoluto y no una cantidad de segundos
+    if seconds > 1e9:
+        seconds -= now
+    return max(0.0, seconds)
+
+
+class RateLimiter:
+    """
+    Token bucket con ajuste adaptativo de la tasa (AIMD).
+
+    Args:
+        rate: requests por segundo con las que parte el bucket.
+        min_rate / max_rate: límites del ajuste automático.
+        increase: requests/s que se suman por cada respuesta 2xx/3xx.
+    """
+
+    def __init__(self, rate=MULTIVENDE_RATE, min_rate=MULTIVENDE_MIN_RATE,
+                 max_rate=MULTIVENDE_MAX_RATE, increase=0.5):
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.rate = min(max(rate, min_rate), max_rate)
+        self.increase = increase
+        self.tokens = 1.0
+        self.paused_until = 0.0
+        self.throttled = 0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _capacity(self):
+        # Ráfaga máxima de un segundo de requests a la tasa actual
+        return max(1.0, self.rate)
+
+    def acquire(self):
+        """Bloquea hasta que haya un token disponible y lo consume."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self._capacity(), self.tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                wait = self.paused_until - now
+                if wait <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Detiene todos los requests durante `seconds`."""
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+    def on_throttle(self, retry_after=None):
+        """Respuesta 429: reduce la tasa a la mitad y espera lo que indique la API."""
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.throttled += 1
+        logger.warning("Multivende throttling (429), nueva tasa %.2f req/s", self.rate)
+        self.pause(retry_after if retry_after is not None else 1 / self.rate)
+
+    def on_server_error(self):
+        """Respuesta 5xx: baja la tasa sin pausar, la API puede estar sobrecargada."""
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * 0.75)
+
+    def on_success(self, headers=None):
+        """Respuesta exitosa: sube la tasa y respeta los headers de cuota si vienen."""
+        remaining = limit = reset = None
+        if headers:
+            remaining = headers.get("X-RateLimit-Remaining", headers.get("RateLimit-Remaining"))
+            limit = headers.get("X-RateLimit-Limit", headers.get("RateLimit-Limit"))
+            reset = _parse_seconds(headers.get("X-RateLimit-Reset", headers.get("RateLimit-Reset")))
+        try:
+            remaining = int(remaining) if remaining is not None else None
+            limit = int(limit) if limit is not None else None
+        except ValueError:
+            remaining = limit = None
+
+        if remaining is not None and remaining <= 0 and reset:
+            # Cuota agotada: esperar a que se renueve la ventana
+            self.pause(reset)
+            return
+        with self._lock:
+            if remaining is not None and limit and remaining < limit * 0.1:
+                # Queda menos del 10% de la cuota, bajar antes de recibir un 429
+                self.rate = max(self.min_rate, self.rate * 0.75)
+            else:
+                self.rate = min(self.max_rate, self.rate + self.increase)
+
+
+def _endpoint_for(path: str) -> str:
+    """Clasifica un path en una familia de endpoint para elegir su timeout."""
+    for name, pattern in _ENDPOINT_PATTERNS:
+        if pattern.search(path):
+            return name
+    return "default"
+
+
+class MultivendeClient:
+    """
+    Sesión HTTP con pool keep-alive hacia Multivende.
+
+    Args:
+        token: bearer token ya desencriptado (opcional para /oauth).
+        base_url: raíz de la API, por defecto MULTIVENDE_URL.
+        pool_size: conexiones simultáneas máximas que se mantienen abiertas.
+        timeouts: dict que sobreescribe entradas de DEFAULT_TIMEOUTS.
+        rate_limiter: RateLimiter a usar; por defecto uno nuevo con la tasa de env.
+        max_retries: reintentos ante respuestas 429.
+        token_provider: objeto con get()/invalidate(token) (ver token_provider.py). Si
+            se entrega, cada request usa su token vigente y un 401 lo recarga una vez.
+    """
+
+    def __init__(self, token=None, base_url=MULTIVENDE_URL, pool_size=MULTIVENDE_POOL_SIZE,
+                 timeouts=None, rate_limiter=None, max_retries=MULTIVENDE_MAX_RETRIES,
+                 token_provider=None):
+        self.base_url = base_url.rstrip("/")
+        self.timeouts = {**DEFAULT_TIMEOUTS, **(timeouts or {})}
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.max_retries = max_retries
+        self.token_provider = token_provider
+
+        # Reintentos solo para errores de conexión y 5xx transitorios en GET
+        retries = Retry(total=2, connect=2, backoff_factor=0.3,
+                        status_forcelist=(502, 503, 504), allowed_methods=("GET",),
+                        raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retries)
+
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Accept": "application/json",
+            "Accept-Encoding": "gzip, deflate",
+        })
+        self.token = token
+
+    @property
+    def token(self):
+        return self._token
+
+    @token.setter
+    def token(self, value):
+        self._token = value
+        if value:
+            self.session.headers["Authorization"] = f"Bearer {value}"
+        else:
+            self.session.headers.pop("Authorization", None)
+
+    def url(self, path: str) -> str:
+        """Construye la URL absoluta para un path relativo a la API."""
+        if path.startswith("http"):
+            return path
+        return f"{self.base_url}{path}"
+
+    def request(self, method, path, endpoint=None, **kwargs) -> requests.Response:
+        """
+        Ejecuta un request usando el pool, el timeout del endpoint y el rate limiter.
+
+        Las respuestas 429 se reintentan hasta `max_retries` veces esperando lo que
+        indique Retry-After; si se agotan se retorna la última respuesta. Con
+        `token_provider`, un 401 invalida el token cacheado y se reintenta una vez.
+        """
+        if path.startswith(self.base_url):
+            path = path[len(self.base_url):]
+        endpoint = endpoint or _endpoint_for(path)
+        kwargs.setdefault("timeout", self.timeouts.get(endpoint, self.timeouts["default"]))
+        headers = kwargs.pop("headers", None) or {}
+        token, auth_retried = None, False
+        for attempt in range(self.max_retries + 1):
+            if self.token_provider is not None:
+                # Header por request: el token puede rotar mientras otros threads usan la sesión
+                token = self.token_provider.get()
+                headers = {**headers, "Authorization": f"Bearer {token}"}
+            self.rate_limiter.acquire()
+            response = self.session.request(method, self.url(path), headers=headers, **kwargs)
+            if response.status_code == 401 and self.token_provider is not None and not auth_retried:
+                self.token_provider.invalidate(token)
+                auth_retried = True
+                continue
+            if response.status_code != 429:
+                # Solo las respuestas exitosas suben la tasa; otro 4xx no la cambia
+                if response.status_code < 400:
+                    self.rate_limiter.on_success(response.headers)
+                elif response.status_code >= 500:
+                    self.rate_limiter.on_server_error()
+                return response
+            self.rate_limiter.on_throttle(_parse_seconds(response.headers.get("Retry-After")))
+        logger.error("Multivende sigue respondiendo 429 tras %d reintentos: %s", self.max_retries, path)
+        return response
+
+    def get(self, path, **kwargs) -> requests.Response:
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs) -> requests.Response:
+        return self.request("POST", path, **kwargs)
+
+    def get_json(self, path, **kwargs):
+        """GET que retorna el JSON decodificado. Lanza ValueError si el cuerpo no es JSON."""
+        return self.get(path, **kwargs).json()
+
+    def get_all_pages(self, path, workers=MULTIVENDE_WORKERS) -> list:
+        """
+        Descarga todas las páginas de un listado `.../p/{page}` y retorna sus entries.
+
+        La página 1 entrega `pagination.total_pages`; las páginas restantes se piden
+        en paralelo (máximo `workers` a la vez) y se concatenan en orden de página.
+        `path` debe incluir el placeholder `{page}`. Lanza RuntimeError si alguna
+        página falla, para no trabajar con un listado incompleto.
+        """
+        first = self.get_json(path.format(page=1))
+        pages = first["pagination"]["total_pages"]
+        results = fetch_many(lambda page: self.get_json(path.format(page=page))["entries"],
+                             range(2, pages + 1), workers=workers)
+        if any(entries is None for entries in results):
+            raise RuntimeError(f"No se pudieron descargar todas las páginas de {path}")
+        data = list(first["entries"])
+        for entries in results:
+            data += entries
+        return data
+
+    def iter_scroll(self, path):
+        """
+        Recorre un listado paginado por scroll (`.../limit/N`) y entrega sus entries.
+
+        Sigue `pagination.scroll_id` agregando `_scroll_id` al path hasta que la API
+        deja de retornar scroll o entries. Al terminar compara las entries leídas con
+        el total que informa la primera página (`total_items`) y lanza RuntimeError
+        si faltan, por ejemplo si la API no entregó `scroll_id`, para no trabajar
+        con un listado incompleto.
+        """
+        separator = "&" if "?" in path else "?"
+        response = self.get_json(path)
+        pagination = response.get("pagination") or {}
+        total = pagination.get("total_items", pagination.get("total"))
+        read = 0
+        while True:
+            entries = response.get("entries") or []
+            read += len(entries)
+            yield from entries
+            scroll_id = (response.get("pagination") or {}).get("scroll_id")
+            if scroll_id is None or not entries:
+                break
+            response = self.get_json(f"{path}{separator}_scroll_id={scroll_id}")
+        if total is None:
+            logger.warning("El listado %s no informa su total; no se puede verificar que este completo (%d entries)",
+                           path, read)
+        elif read < total:
+            raise RuntimeError(f"Listado incompleto {path}: {read} de {total} entries")
+        elif read > total:
+            logger.warning("El listado %s entrego %d entries de %d informadas", path, read, total)
+
+    def close(self):
+        self.session.close()
+
+
+# Cliente compartido por proceso (webhook y jobs)
+_client = None
+
+
+def get_client(token=None) -> MultivendeClient:
+    """Retorna el cliente del proceso, actualizando el token si se entrega uno nuevo."""
+    global _client
+    if _client is None:
+        _client = MultivendeClient(token)
+    elif token and token != _client.token:
+        _client.token = token
+    return _client
+
+
+def fetch_many(fn, items, workers=MULTIVENDE_WORKERS) -> list:
+    """
+    Aplica `fn` a cada elemento de `items` con concurrencia acotada.
+
+    Los resultados se retornan en el mismo orden que `items`. Si `fn` falla para
+    un elemento se registra el error y su posición queda en None, sin detener el
+    resto de la ejecución.
+    """
+    def _safe(item):
+        try:
+            return fn(item)
+        except Exception as e:
+            logger.error("Error procesando %s: %s", item, e)
+            return None
+
+    if workers <= 1:
+        return [_safe(item) for item in items]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_safe, items))
@@ -1,13 +1,52 @@
 from flask import Flask, request, abort
 import base64
 import os
+import threading
 from dotenv import load_dotenv
-from utils import *
+from utils import fetch_webhook_checkout, write_checkouts
+from database import pool_stats
+from webhook_queue import WebhookQueue, WebhookWorkers, BatchWriter
+from supabase_sync import is_enabled as supabase_enabled
+from supabase_outbox import OutboxRelay, stats as outbox_stats
 
 load_dotenv()
 
 app = Flask(__name__)
 
+def write_batch(results):
+    """Escribe en un solo lote los (venta, productos) descargados por los workers."""
+    write_checkouts(results)
+
+# Cola, workers y relay del proceso; se crean en el primer request de cada
+# worker de gunicorn, nunca al importar (un fork no hereda threads ni conexiones)
+_runtime = None
+_runtime_pid = None
+_runtime_lock = threading.Lock()
+
+
+def get_runtime():
+    """
+    Retorna (queue, workers, relay) del proceso, creándolos y arrancándolos una
+    sola vez por pid.
+
+    Los checkouts se descargan en segundo plano desde una cola durable y se
+    escriben en micro-lotes; Supabase se sincroniza desde el outbox de MySQL,
+    fuera del camino del webhook.
+    """
+    global _runtime, _runtime_pid
+    if _runtime_pid != os.getpid():
+        with _runtime_lock:
+            if _runtime_pid != os.getpid():
+                queue = WebhookQueue()
+                workers = WebhookWorkers(queue, fetch_webhook_checkout, writer=BatchWriter(queue, write_batch))
+                workers.start()
+                relay = OutboxRelay()
+                if supabase_enabled():
+                    relay.start()
+                _runtime = (queue, workers, relay)
+                _runtime_pid = os.getpid()
+    return _runtime
+
 # Set your expected Basic Auth credentials
 USERNAME = os.getenv("USERNAME")
 PASSWORD = os.getenv("PASSWORD")
@@ -42,13 +81,30 @@ def webhook():
 
     print("ℹ️ This is the Id: ",id)
 
-    webhook_load_checkout(id)
+    queue, _, _ = get_runtime()
+    _, coalesced = queue.enqueue(id)
 
-    return {"status": "received"}, 200
+    return {"status": "coalesced" if coalesced else "queued"}, 202
 
 @app.route("/health", methods=["GET"])
 def health():
+    # El healthcheck del contenedor arranca los workers sin esperar un webhook
+    get_runtime()
     return "OK", 200
 
+@app.route("/queue-stats", methods=["GET"])
+def queue_status():
+    queue, _, _ = get_runtime()
+    return queue.stats(), 200
+
+@app.route("/outbox-stats", methods=["GET"])
+def outbox_status():
+    _, _, relay = get_runtime()
+    return {**outbox_stats(), "sent": relay.sent, "failed": relay.failed}, 200
+
+@app.route("/pool-stats", methods=["GET"])
+def pool_status():
+    return pool_stats(), 200
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000)
@@ -0,0 +1,133 @@
+"""
+supabase_backfill.py — Carga masiva de checkouts_full / checkout_items a Supabase
+
+Lee `checkouts_full` desde MySQL con un cursor del lado del servidor, ordenado
+por (fecha, id), en bloques de `--chunk-size` filas; por cada bloque carga sus
+items con una consulta y los envía con los upserts en lote de supabase_sync.py.
+La memoria queda acotada a un bloque.
+
+El avance se guarda en `sync_state` (job `supabase_backfill:<rango>`) con la
+fecha del último bloque enviado completo, así una corrida interrumpida sigue
+desde ahí (las filas con esa misma fecha se reenvían; el upsert es idempotente).
+Si un bloque tiene filas rechazadas el checkpoint deja de avanzar y el comando
+termina con código 1 al final.
+
+Uso:
+    python supabase_backfill.py                                 # toda la tabla
+    python supabase_backfill.py --since 2025-01-01 --until 2025-01-31
+    python supabase_backfill.py --since 2025-01-01 --restart    # ignora el checkpoint
+"""
+
+import sys
+import logging
+import argparse
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from models import checkouts_full, checkout_items
+from database import get_engine
+from checkout_parser import CHECKOUT_FIELDS, ITEM_FIELDS, CheckoutRecord, ItemRecord
+from supabase_sync import checkout_payload, item_payload, sync_payloads, is_enabled
+from watermarks import get_watermark, set_watermark
+
+# Setting up logger
+logger = logging.getLogger(__name__)
+logging.basicConfig(format='%(asctime)s: %(message)s', stream=sys.stdout,
+                    level=logging.INFO)
+
+BACKFILL_CHUNK_SIZE = 500
+
+_checkout_columns = [checkouts_full.__table__.c[column] for column in CHECKOUT_FIELDS]
+_item_columns = [checkout_items.__table__.c[column] for column in ITEM_FIELDS]
+
+
+def checkpoint_job(since=None, until=None):
+    """
+    Nombre del job en sync_state para un rango (cada rango tiene su checkpoint).
+
+    Usa las fechas tal como las entrega el operador (`until` inclusivo).
+    """
+    since = since.strftime("%Y%m%d") if since else "inicio"
+    until = until.strftime("%Y%m%d") if until else "fin"
+    return f"supabase_backfill:{since}-{until}"
+
+
+def iter_chunks(engine, since=None, until=None, chunk_size=BACKFILL_CHUNK_SIZE):
+    """
+    Entrega bloques de CheckoutRecord de checkouts_full ordenados por (fecha, id).
+
+    `since` es inclusivo y `until` exclusivo. Usa un cursor del lado del servidor
+    (stream_results), por lo que solo un bloque vive en memoria.
+    """
+    table = checkouts_full.__table__
+    stmt = select(*_checkout_columns).order_by(table.c.fecha, table.c.id)
+    if since is not None:
+        stmt = stmt.where(table.c.fecha >= since)
+    if until is not None:
+        stmt = stmt.where(table.c.fecha < until)
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=chunk_size).execute(stmt)
+        for rows in result.partitions():
+            yield [CheckoutRecord(*row) for row in rows]
+
+
+def load_items(engine, ventas):
+    """Retorna {id_venta: [ItemRecord]} para los checkouts de un bloque."""
+    table = checkout_items.__table__
+    items = {}
+    # Conexion aparte: la del cursor sigue abierta leyendo checkouts_full
+    with engine.connect() as conn:
+        stmt = select(*_item_columns).where(table.c.id_venta.in_([venta.id_venta for venta in ventas]))
+        for row in conn.execute(stmt):
+            item = ItemRecord(*row)
+            items.setdefault(item.id_venta, []).append(item)
+    return items
+
+
+def backfill(engine, since=None, until=None, chunk_size=BACKFILL_CHUNK_SIZE, restart=False):
+    """
+    Envía a Supabase los checkouts del rango desde el último checkpoint.
+
+    `since` y `until` son días inclusivos, como en la línea de comandos.
+    Retorna (checkouts enviados, checkouts con error).
+    """
+    job = checkpoint_job(since, until)
+    # La consulta usa el limite exclusivo: el dia siguiente a `until`
+    end = until + timedelta(days=1) if until else None
+    start = since
+    checkpoint = None if restart else get_watermark(engine, job)
+    if checkpoint is not None:
+        start = max(checkpoint, since) if since else checkpoint
+        logger.info(f"Retomando {job} desde {start}")
+
+    sent, failed, advancing = 0, 0, True
+    for ventas in iter_chunks(engine, start, end, chunk_size):
+        items = load_items(engine, ventas)
+        results = sync_payloads([checkout_payload(venta) for venta in ventas],
+                                [item_payload(item) for venta in ventas for item in items.get(venta.id_venta, [])])
+        errors = {key[0] for result in results.values() for key, _ in result.failed}
+        sent += len(ventas) - len(errors)
+        failed += len(errors)
+        if errors and advancing:
+            advancing = False
+            logger.warning(f"{len(errors)} checkouts rechazados, el checkpoint queda en {checkpoint}")
+        if advancing:
+            checkpoint = ventas[-1].fecha
+            set_watermark(engine, job, checkpoint)
+        logger.info(f"Backfill {job}: enviados {sent} con error {failed} (hasta {ventas[-1].fecha})")
+    return sent, failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--since", type=datetime.fromisoformat, default=None, help="fecha inicial (inclusiva)")
+    parser.add_argument("--until", type=datetime.fromisoformat, default=None, help="fecha final (inclusiva)")
+    parser.add_argument("--chunk-size", type=int, default=BACKFILL_CHUNK_SIZE)
+    parser.add_argument("--restart", action="store_true", help="ignora el checkpoint guardado")
+    args = parser.parse_args()
+
+    if not is_enabled():
+        logger.error("SUPABASE_SERVICE_KEY no configurado")
+        sys.exit(1)
+    sent, failed = backfill(get_engine(), args.since, args.until, args.chunk_size, args.restart)
+    logger.info(f"Backfill terminado: {sent} checkouts enviados, {failed} con error")
+    sys.exit(1 if failed else 0)
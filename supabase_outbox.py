@@ -0,0 +1,218 @@
+"""
+supabase_outbox.py — Outbox transaccional para el dual-write a Supabase
+
+`enqueue(conn, results)` deja en `supabase_outbox` un payload por
+checkout (la fila de checkouts_full y sus items, ya armados como los espera
+PostgREST) usando la misma conexión/transacción con que se escriben
+`checkouts_full` y `checkout_items`: si el write a MySQL se revierte, el outbox
+también.
+
+`OutboxRelay` es un thread que drena el outbox hacia Supabase en lotes:
+
+  * Toma las filas vencidas en orden de id, y por cada id_venta envía solo el
+    payload más reciente del lote; las filas anteriores quedan cubiertas.
+  * Un id_venta con una fila esperando reintento bloquea sus filas posteriores,
+    así un payload antiguo nunca se envía después de uno más nuevo.
+  * Las filas rechazadas se reintentan con backoff exponencial hasta
+    SUPABASE_OUTBOX_MAX_BACKOFF; nunca se descartan.
+  * Cada ciclo corre bajo `database.advisory_lock`, de modo que con varios
+    workers de gunicorn solo un proceso drena a la vez.
+
+Variables de entorno:
+    SUPABASE_OUTBOX_BATCH_SIZE     filas por ciclo (default 200)
+    SUPABASE_OUTBOX_POLL_MS        espera entre ciclos sin trabajo (default 1000)
+    SUPABASE_OUTBOX_RETRY_SECONDS  espera base antes de reintentar (default 5)
+    SUPABASE_OUTBOX_MAX_BACKOFF    espera máxima entre reintentos (default 900)
+"""
+
+import os
+import json
+import logging
+import threading
+import traceback
+from datetime import datetime, timedelta
+from sqlalchemy import select, insert, update, delete, func
+from models import supabase_outbox
+from database import get_engine, advisory_lock
+from supabase_sync import checkout_payload, item_payload, sync_payloads, is_enabled
+
+logger = logging.getLogger(__name__)
+
+SUPABASE_OUTBOX_BATCH_SIZE = int(os.getenv("SUPABASE_OUTBOX_BATCH_SIZE", "200"))
+SUPABASE_OUTBOX_POLL_SECONDS = int(os.getenv("SUPABASE_OUTBOX_POLL_MS", "1000")) / 1000
+SUPABASE_OUTBOX_RETRY_SECONDS = float(os.getenv("SUPABASE_OUTBOX_RETRY_SECONDS", "5"))
+SUPABASE_OUTBOX_MAX_BACKOFF = float(os.getenv("SUPABASE_OUTBOX_MAX_BACKOFF", "900"))
+RELAY_LOCK_NAME = "supabase_outbox_relay"
+
+outbox = supabase_outbox.__table__
+
+
+def enqueue(conn, results):
+    """
+    Agrega al outbox un payload por checkout, en la transacción de `conn`.
+
+    Input :
+    ---------
+      *  conn : SQLAlchemy.Connection. Conexión de la transacción que escribe MySQL.
+      *  results : list. Tuplas (CheckoutRecord, [ItemRecord]) de parse_checkout.
+
+    Output :
+    ---------
+      * int. Filas agregadas al outbox.
+    """
+    if not results:
+        return 0
+    now = datetime.now()
+    rows = [{
+        "id_venta": row.id_venta,
+        "payload": json.dumps({"checkout": checkout_payload(row), "items": [item_payload(item) for item in items]},
+                              default=str, ensure_ascii=False),
+        "attempts": 0,
+        "next_attempt_at": now,
+        "created_at": now,
+    } for row, items in results]
+    conn.execute(insert(outbox), rows)
+    return len(rows)
+
+
+def stats(engine=None):
+    """Filas pendientes, en reintento y antigüedad de la más vieja (segundos)."""
+    engine = engine or get_engine()
+    with engine.connect() as conn:
+        pending, retrying, oldest = conn.execute(select(
+            func.count(),
+            func.sum(func.coalesce(outbox.c.attempts, 0) > 0),
+            func.min(outbox.c.created_at),
+        )).one()
+    return {
+        "pending": pending,
+        "retrying": int(retrying or 0),
+        "oldest_seconds": (datetime.now() - oldest).total_seconds() if oldest else 0,
+    }
+
+
+class OutboxRelay:
+    """
+    Thread que envía el outbox a Supabase en lotes (ver docstring del módulo).
+
+    Args:
+        engine: engine de MySQL (default get_engine()).
+        batch_size: filas del outbox por ciclo.
+        poll_seconds: espera entre ciclos sin trabajo.
+        retry_seconds: espera base de reintento, se duplica por intento.
+        max_backoff: espera máxima entre reintentos.
+    """
+
+    def __init__(self, engine=None, batch_size=SUPABASE_OUTBOX_BATCH_SIZE,
+                 poll_seconds=SUPABASE_OUTBOX_POLL_SECONDS, retry_seconds=SUPABASE_OUTBOX_RETRY_SECONDS,
+                 max_backoff=SUPABASE_OUTBOX_MAX_BACKOFF):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self.retry_seconds = retry_seconds
+        self.max_backoff = max_backoff
+        self.sent = 0
+        self.failed = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def start(self):
+        """Arranca el thread del relay; idempotente y seguro tras un fork."""
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        self._pid = os.getpid()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="supabase-outbox-relay", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                drained = self.drain_once()
+            except Exception as e:
+                logger.debug(traceback.format_exc())
+                logger.error("[SupabaseOutbox] Error drenando el outbox: %s", e)
+                drained = 0
+            if drained < self.batch_size:
+                self._stop.wait(self.poll_seconds)
+
+    def drain_once(self):
+        """
+        Envía un lote del outbox. Retorna las filas procesadas (0 si otro proceso
+        tiene el lock o no hay filas vencidas).
+        """
+        if not is_enabled():
+            return 0
+        engine = self.engine or get_engine()
+        try:
+            with advisory_lock(RELAY_LOCK_NAME, 0, engine=engine):
+                return self._drain(engine)
+        except TimeoutError:
+            return 0
+
+    def drain(self):
+        """Envía lotes hasta que no queden filas vencidas. Retorna las filas procesadas."""
+        total = 0
+        while True:
+            drained = self.drain_once()
+            total += drained
+            if drained == 0:
+                return total
+
+    def _drain(self, engine):
+        now = datetime.now()
+        # Un id_venta con una fila esperando reintento no avanza, para respetar el orden
+        waiting = select(outbox.c.id_venta).where(outbox.c.next_attempt_at > now)
+        with engine.connect() as conn:
+            rows = conn.execute(
+                select(outbox.c.id, outbox.c.id_venta, outbox.c.payload, outbox.c.attempts)
+                .where(outbox.c.next_attempt_at <= now, outbox.c.id_venta.not_in(waiting))
+                .order_by(outbox.c.id)
+                .limit(self.batch_size)
+            ).all()
+        if not rows:
+            return 0
+
+        # Por id_venta solo se envía el payload más reciente del lote
+        latest, ids, attempts = {}, {}, {}
+        for row in rows:
+            latest[row.id_venta] = json.loads(row.payload)
+            ids.setdefault(row.id_venta, []).append(row.id)
+            attempts[row.id_venta] = max(attempts.get(row.id_venta, 0), row.attempts)
+
+        checkouts = [payload["checkout"] for payload in latest.values()]
+        items = [item for payload in latest.values() for item in payload["items"]]
+        try:
+            results = sync_payloads(checkouts, items)
+            errors = {}
+            for result in results.values():
+                for key, error in result.failed:
+                    errors.setdefault(key[0], error)
+        except Exception as e:
+            errors = {id_venta: f"{type(e).__name__}: {e}" for id_venta in latest}
+
+        done = [id for id_venta, row_ids in ids.items() if id_venta not in errors for id in row_ids]
+        with engine.begin() as conn:
+            if done:
+                conn.execute(delete(outbox).where(outbox.c.id.in_(done)))
+            for id_venta, error in errors.items():
+                delay = min(self.retry_seconds * 2 ** attempts[id_venta], self.max_backoff)
+                conn.execute(
+                    update(outbox)
+                    .where(outbox.c.id.in_(ids[id_venta]))
+                    .values(attempts=outbox.c.attempts + 1,
+                            next_attempt_at=now + timedelta(seconds=delay),
+                            last_error=error[:2000])
+                )
+        self.sent += len(latest) - len(errors)
+        self.failed += len(errors)
+        if errors:
+            logger.warning("[SupabaseOutbox] %d checkouts se reintentarán", len(errors))
+        logger.info("[SupabaseOutbox] checkouts enviados: %d/%d", len(latest) - len(errors), len(latest))
+        return len(rows)
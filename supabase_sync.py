@@ -1,138 +1,218 @@
-"""
-supabase_sync.py — Dual-write para novy-api
-
-Escribe checkouts y sus items directamente en Supabase (schema novy)
-inmediatamente después del write a MySQL, sin esperar el cron de novy-upsert.
-
-Usa PostgREST vía HTTP (no cliente oficial de Supabase).
-Requiere /app/.supabase_env con SUPABASE_URL y SUPABASE_SERVICE_KEY.
-"""
-
-import os
-import logging
-import requests
-from datetime import datetime, timezone
-
-logger = logging.getLogger(__name__)
-
-# --- Configuración ---
-# Lee de env vars (configuradas en Coolify). Fallback a archivo .supabase_env para compatibilidad.
-SUPABASE_URL = os.getenv("SUPABASE_URL", "")
-SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY", "")
-
-if not SUPABASE_URL or not SUPABASE_SERVICE_KEY:
-    try:
-        from dotenv import dotenv_values
-        _config = dotenv_values("/app/.supabase_env")
-        SUPABASE_URL = SUPABASE_URL or _config.get("SUPABASE_URL", "https://supabase.novaq.cl")
-        SUPABASE_SERVICE_KEY = SUPABASE_SERVICE_KEY or _config.get("SUPABASE_SERVICE_KEY", "")
-    except Exception:
-        pass
-
-_HEADERS = {
-    "apikey": SUPABASE_SERVICE_KEY,
-    "Authorization": f"Bearer {SUPABASE_SERVICE_KEY}",
-    "Content-Type": "application/json",
-    "Accept-Profile": "novy",
-    "Content-Profile": "novy",
-    "Prefer": "resolution=merge-duplicates,return=minimal",
-}
-
-
-def _iso(value) -> str | None:
-    """Convierte datetime o string a ISO 8601. Retorna None si es vacío."""
-    if value is None:
-        return None
-    if isinstance(value, datetime):
-        return value.isoformat()
-    s = str(value).strip()
-    return s if s else None
-
-
-def _upsert(table: str, payload: dict, on_conflict: str = "") -> bool:
-    """POST a PostgREST con upsert. Retorna True si exitoso."""
-    url = f"{SUPABASE_URL}/rest/v1/{table}"
-    if on_conflict:
-        url = f"{url}?on_conflict={on_conflict}"
-    try:
-        resp = requests.post(url, json=payload, headers=_HEADERS, timeout=10)
-        if resp.status_code in (200, 201):
-            return True
-        logger.warning(
-            "[SupabaseSync] upsert %s falló — status %s: %s",
-            table, resp.status_code, resp.text[:200],
-        )
-        return False
-    except requests.RequestException as e:
-        logger.error("[SupabaseSync] Error de red al upsert %s: %s", table, e)
-        return False
-
-
-def sync_checkout(tmp: dict, productos: list) -> None:
-    """
-    Sincroniza un checkout y sus items con Supabase novy schema.
-
-    Args:
-        tmp: dict con los datos del checkout (tal como se construye en utils.py)
-        productos: list de dicts con los items del checkout
-    """
-    if not SUPABASE_SERVICE_KEY:
-        logger.warning("[SupabaseSync] SUPABASE_SERVICE_KEY no configurado — skip sync")
-        return
-
-    # Tomar el último estado de pago (igual que el DataFrame processing)
-    estados = tmp.get("estado venta", [])
-    estado_venta = estados[-1] if estados else None
-
-    checkout_payload = {
-        "costo_envio": tmp.get("costo de envio"),
-        "estado_boleta": tmp.get("estado boleta"),
-        "estado_entrega": tmp.get("estado entrega"),
-        "estado_venta": estado_venta,
-        "fecha": _iso(tmp.get("fecha")),
-        "mail": tmp.get("mail"),
-        "market": tmp.get("market"),
-        "n_venta": tmp.get("n venta"),
-        "nombre_cliente": tmp.get("nombre"),
-        "phone": tmp.get("phone"),
-        "url_boleta": tmp.get("url boleta"),
-        "n_seguimiento": tmp.get("N seguimiento"),
-        "codigo": tmp.get("codigo"),
-        "codigo_venta": tmp.get("codigo venta"),
-        "courier": tmp.get("courier") or "Empty",
-        "clase_de_envio": tmp.get("clase de envio"),
-        "delivery_status": tmp.get("delivery status"),
-        "direccion": tmp.get("direccion"),
-        "impresion_etiqueta": tmp.get("estado impresion etiqueta") or "not_printed",
-        "fecha_despacho": _iso(tmp.get("fecha despacho")),
-        "fecha_promesa": _iso(tmp.get("fecha promesa")),
-        "id_venta": tmp.get("id venta"),
-        "status_etiqueta": tmp.get("status etiqueta"),
-    }
-
-    ok = _upsert("checkouts_full", checkout_payload)
-    n_venta = tmp.get("n venta", "?")
-    if ok:
-        logger.info("[SupabaseSync] checkouts_full sincronizado — n_venta=%s", n_venta)
-    else:
-        logger.warning("[SupabaseSync] checkouts_full sync falló — n_venta=%s", n_venta)
-
-    # Sync items
-    items_ok = 0
-    for item in productos:
-        item_payload = {
-            "codigo_producto": item.get("codigo producto"),
-            "nombre_producto": item.get("nombre producto"),
-            "id_padre_producto": item.get("id padre producto"),
-            "id_hijo_producto": item.get("id hijo producto"),
-            "cantidad": item.get("cantidad"),
-            "precio": item.get("precio"),
-            "id_venta": item.get("id venta"),
-        }
-        if _upsert("checkout_items", item_payload, on_conflict="id_venta,id_hijo_producto"):
-            items_ok += 1
-
-    logger.info(
-        "[SupabaseSync] checkout_items sincronizados: %d/%d — n_venta=%s",
-        items_ok, len(productos), n_venta,
-    )
+"""
+supabase_sync.py — Dual-write para novy-api
+
+Escribe checkouts y sus items en Supabase (schema novy) sin esperar el cron de
+novy-upsert. Los payloads se arman desde las mismas filas de checkout_parser.py
+que se escriben en MySQL. Nadie llama a Supabase en línea con el write: los
+payloads quedan en el outbox de MySQL y OutboxRelay los envía con
+sync_payloads (ver supabase_outbox.py).
+
+Usa PostgREST vía HTTP (no cliente oficial de Supabase) sobre una sesión
+keep-alive compartida. Cada tabla se envía como arrays JSON de upsert, en
+bloques de hasta SUPABASE_MAX_BATCH_BYTES. PostgREST aplica cada array en una
+transacción, así que si un bloque es rechazado por sus datos (400, 409, 413,
+422) se divide en mitades hasta aislar las filas con error, que se reportan con
+su llave. Los errores de autenticación, de ruta, de red o 5xx no dependen de
+las filas: el bloque completo se reporta como fallido sin dividirlo.
+
+Requiere /app/.supabase_env con SUPABASE_URL y SUPABASE_SERVICE_KEY.
+"""
+
+import os
+import json
+import logging
+import requests
+from collections import namedtuple
+from datetime import datetime, timezone
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# --- Configuración ---
+# Lee de env vars (configuradas en Coolify). Fallback a archivo .supabase_env para compatibilidad.
+SUPABASE_URL = os.getenv("SUPABASE_URL", "")
+SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY", "")
+
+if not SUPABASE_URL or not SUPABASE_SERVICE_KEY:
+    try:
+        from dotenv import dotenv_values
+        _config = dotenv_values("/app/.supabase_env")
+        SUPABASE_URL = SUPABASE_URL or _config.get("SUPABASE_URL", "https://supabase.novaq.cl")
+        SUPABASE_SERVICE_KEY = SUPABASE_SERVICE_KEY or _config.get("SUPABASE_SERVICE_KEY", "")
+    except Exception:
+        pass
+
+SUPABASE_MAX_BATCH_BYTES = int(os.getenv("SUPABASE_MAX_BATCH_BYTES", "1000000"))
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "10"))
+
+_HEADERS = {
+    "apikey": SUPABASE_SERVICE_KEY,
+    "Authorization": f"Bearer {SUPABASE_SERVICE_KEY}",
+    "Content-Type": "application/json",
+    "Accept-Profile": "novy",
+    "Content-Profile": "novy",
+    "Prefer": "resolution=merge-duplicates,return=minimal",
+}
+
+
+def _iso(value) -> str | None:
+    """
+    Convierte datetime o string a ISO 8601. Retorna None si es vacío.
+
+    Los datetime naive de checkout_parser.py están en UTC: se envían con offset
+    explícito para que una columna timestamptz no los lea en la zona del servidor.
+    """
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.astimezone(timezone.utc).isoformat()
+    s = str(value).strip()
+    return s if s else None
+
+
+# Resultado de un upsert por tabla: filas enviadas y [(llave, error)] rechazadas
+SyncResult = namedtuple("SyncResult", ["table", "sent", "failed"])
+
+# Rechazos de PostgREST causados por las filas enviadas: dividir el bloque los aísla
+_DATA_ERRORS = (400, 409, 413, 422)
+
+_session = None
+
+
+def _get_session() -> requests.Session:
+    """Sesión keep-alive del proceso hacia Supabase, creada en la primera llamada."""
+    global _session
+    if _session is None:
+        session = requests.Session()
+        session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        session.headers.update(_HEADERS)
+        _session = session
+    return _session
+
+
+def _post(table: str, body: bytes, on_conflict: str = ""):
+    """
+    POST de un array JSON ya serializado. Retorna (ok, error, divisible).
+
+    `divisible` es True cuando PostgREST rechazó los datos (_DATA_ERRORS); solo
+    en ese caso dividir el bloque permite aislar las filas con error.
+    """
+    url = f"{SUPABASE_URL}/rest/v1/{table}"
+    if on_conflict:
+        url = f"{url}?on_conflict={on_conflict}"
+    try:
+        resp = _get_session().post(url, data=body, timeout=SUPABASE_TIMEOUT)
+    except requests.RequestException as e:
+        return False, f"Error de red: {e}", False
+    if resp.status_code in (200, 201, 204):
+        return True, None, False
+    return False, f"status {resp.status_code}: {resp.text[:200]}", resp.status_code in _DATA_ERRORS
+
+
+def _chunks(encoded, max_bytes=SUPABASE_MAX_BATCH_BYTES):
+    """Agrupa filas serializadas en bloques cuyo array JSON no supera `max_bytes`."""
+    chunk, size = [], 2
+    for item in encoded:
+        if chunk and size + len(item[1]) + 1 > max_bytes:
+            yield chunk
+            chunk, size = [], 2
+        chunk.append(item)
+        size += len(item[1]) + 1
+    if chunk:
+        yield chunk
+
+
+def _send(table, chunk, on_conflict, failed):
+    """Envía un bloque de (llave, json); ante un rechazo de datos lo divide para aislar filas."""
+    ok, error, divisible = _post(table, b"[" + b",".join(body for _, body in chunk) + b"]", on_conflict)
+    if ok:
+        return
+    if len(chunk) == 1 or not divisible:
+        failed.extend((key, error) for key, _ in chunk)
+        return
+    middle = len(chunk) // 2
+    _send(table, chunk[:middle], on_conflict, failed)
+    _send(table, chunk[middle:], on_conflict, failed)
+
+
+def upsert_rows(table: str, rows: list, key_fields: tuple, on_conflict: str = "",
+                max_bytes: int = SUPABASE_MAX_BATCH_BYTES) -> SyncResult:
+    """
+    Upsert en lote de dicts en una tabla de PostgREST.
+
+    Args:
+        table: tabla del schema novy.
+        rows: list de dicts serializables a JSON.
+        key_fields: campos que identifican cada fila en el reporte de fallas.
+        on_conflict: columnas de la llave de upsert (default la llave primaria).
+        max_bytes: tamaño máximo del body de cada POST.
+
+    Returns:
+        SyncResult con las filas enviadas y las rechazadas como (llave, error).
+    """
+    encoded = [(tuple(row[field] for field in key_fields),
+                json.dumps(row, default=str, ensure_ascii=False).encode())
+               for row in rows]
+    failed = []
+    for chunk in _chunks(encoded, max_bytes):
+        _send(table, chunk, on_conflict, failed)
+    # Un error de bloque (auth, ruta, red) se reporta una vez, no una por fila
+    by_error = {}
+    for key, error in failed:
+        by_error.setdefault(error, []).append(key)
+    for error, keys in by_error.items():
+        if len(keys) == 1:
+            logger.warning("[SupabaseSync] upsert %s falló para %s — %s", table, keys[0], error)
+        else:
+            logger.warning("[SupabaseSync] upsert %s falló para %d filas (%s, ...) — %s",
+                           table, len(keys), keys[0], error)
+    return SyncResult(table, len(rows), failed)
+
+
+def checkout_payload(row) -> dict:
+    """Fila de novy.checkouts_full a partir de un CheckoutRecord (checkout_parser.py)."""
+    payload = row.as_dict()
+    payload.pop("updated_at", None)
+    for field in ("fecha", "fecha_despacho", "fecha_promesa"):
+        payload[field] = _iso(payload[field])
+    payload["courier"] = payload["courier"] or "Empty"
+    payload["impresion_etiqueta"] = payload["impresion_etiqueta"] or "not_printed"
+    return payload
+
+
+def item_payload(item) -> dict:
+    """Fila de novy.checkout_items a partir de un ItemRecord (checkout_parser.py)."""
+    return item.as_dict()
+
+
+def is_enabled() -> bool:
+    """True si hay credenciales de Supabase configuradas."""
+    return bool(SUPABASE_SERVICE_KEY)
+
+
+def sync_payloads(checkouts: list, items: list) -> dict:
+    """
+    Upsert en lote de payloads ya armados con checkout_payload / item_payload.
+
+    Returns:
+        dict tabla -> SyncResult. Vacío si Supabase no está configurado o no hay
+        checkouts.
+    """
+    if not is_enabled():
+        logger.warning("[SupabaseSync] SUPABASE_SERVICE_KEY no configurado — skip sync")
+        return {}
+    if not checkouts:
+        return {}
+
+    results = {"checkouts_full": upsert_rows("checkouts_full", checkouts, ("id_venta",))}
+    if items:
+        results["checkout_items"] = upsert_rows("checkout_items", items, ("id_venta", "id_hijo_producto"),
+                                                on_conflict="id_venta,id_hijo_producto")
+    for result in results.values():
+        logger.info("[SupabaseSync] %s sincronizados: %d/%d",
+                    result.table, result.sent - len(result.failed), result.sent)
+    return results
+
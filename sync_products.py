@@ -1,13 +1,16 @@
 import logging
-from sqlalchemy import select, create_engine
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 import os
 import sys
 import json
 import requests
 from models import auth_app, Product, Attributes
+from database import get_engine
 from datetime import datetime, timezone
 from utils import *
+from token_provider import authorized_client, TokenUnavailable
+from multivende_client import get_client
 import json
 from time import sleep
 from dotenv import load_dotenv
@@ -28,41 +31,24 @@ logging.basicConfig(format='%(asctime)s: %(message)s', stream=sys.stdout,
                     level=logging.INFO)
 
 # Making engine
-engine = create_engine(SQLALCHEMY_DATABASE_URI,
-                        pool_recycle=3600,   # recycle connections every hour
-                        pool_pre_ping=True,
-                        connect_args={
-                            "ssl_ca": ssl
-                            }
-                        )
+engine = get_engine()
 
 # Get data from tables
 logger.info('Retrieving data from db.')
-with Session(engine) as session:
-    last_auth = session.scalar(select(auth_app).order_by(auth_app.expire.desc()))
 
-if last_auth == None:
-    logger.error("Failed authentication")
-    sys.exit(0)
-        
-diff = datetime.now(timezone.utc) - last_auth.expire.replace(tzinfo=timezone.utc)
-# The token expired
-if diff.total_seconds()/3600 > 6:
-    logger.warning('Refresh token expired.')
+# Token desencriptado desde auth (ver token_provider.py)
+try:
+    client = authorized_client()
+except TokenUnavailable as e:
+    logger.warning(str(e))
     sys.exit(0)
-
-# Decrypt token
-token = decrypt(last_auth.token, SECRET_KEY)
 #print(f"Token: ${token}")
 # Get products data
 logger.info('Recolectando datos de atributos')
 merchant_id = MERCHANT_ID
-url = f"https://app.multivende.com/api/m/{merchant_id}/all-product-attributes"
-headers = {
-        'Authorization': f'Bearer {token}'
-}
+url = f"/api/m/{merchant_id}/all-product-attributes"
 # Get data
-response = requests.request("GET", url, headers=headers)
+response = client.get(url)
     
 try:
     response = response.json()
@@ -82,20 +68,12 @@ att_names = [item["name"]+"-"+item["CustomAttributeSet.name"] for item in att]
     
 # Obtenemos la lista de todos los productos
 logger.info("Solicitando ids de productos")
-url = f"https://app.multivende.com/api/m/{merchant_id}/products/light/p/1"
-response = requests.request("GET", url, headers=headers).json()
-data = response["entries"]
-pages = response["pagination"]["total_pages"]
-# Los productos se organizan en paginas, pasamos por todas, guardando los resultados
-for p in range(pages-1):
-    url = f"https://app.multivende.com/api/m/{merchant_id}/products/light/p/{p+2}"
-    response = requests.request("GET", url, headers=headers).json()
-    data += response["entries"]
+# Los productos se organizan en paginas, las pedimos en paralelo manteniendo el orden
+data = client.get_all_pages(f"/api/m/{merchant_id}/products/light/p/{{page}}")
 
 # Extraemos los id de cada uno
 ids = [item["_id"] for item in data]
 
-logger.info("Pagins totales: %d", pages)
 logger.info("Total de productos: %d", len(ids))
 
 
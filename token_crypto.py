@@ -0,0 +1,24 @@
+"""
+token_crypto.py — Cifrado del token de Multivende guardado en `auth`
+
+Módulo mínimo para los caminos que solo necesitan el token (update_token.py,
+authorize.py y el webhook): no importa pandas ni SQLAlchemy, y `cryptography`
+se carga recién al cifrar o descifrar.
+"""
+
+
+def _fernet(key):
+    from cryptography.fernet import Fernet
+    return Fernet(key.encode())
+
+
+def encrypt(data, key):
+    f = _fernet(key)
+    encoded = data.encode()
+    return f.encrypt(encoded)
+
+
+def decrypt(encrypted, key):
+    f = _fernet(key)
+    decrypted = f.decrypt(encrypted)
+    return decrypted.decode()
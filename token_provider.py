@@ -0,0 +1,219 @@
+"""
+token_provider.py — Token de Multivende desencriptado, cacheado y renovado por proceso
+
+`TokenProvider.get()` lee la fila más reciente de `auth`, valida la ventana de
+gracia del refresh token y desencripta el token una sola vez; luego lo entrega
+desde memoria. Solo vuelve a la base cuando el token está por vencer o cuando
+la API responde 401 (otro proceso lo rotó), por lo que el webhook no hace una
+consulta ni un decrypt por checkout.
+
+Cuando al token le quedan menos de TOKEN_REFRESH_AHEAD_SECONDS, el provider lo
+renueva con `refresh()` antes de que venza. La renovación corre bajo
+`database.advisory_lock`, así exactamente un proceso usa el refresh token (que
+es de un solo uso) y los demás, al obtener el lock, encuentran la fila nueva en
+`auth` y solo la cargan. update_token.py usa la misma rutina.
+
+`authorized_client()` retorna el MultivendeClient compartido del proceso con el
+provider asociado: cada request toma el token vigente y un 401 invalida el
+cache y reintenta una vez con el token recargado.
+
+Variables de entorno:
+    TOKEN_REFRESH_AHEAD_SECONDS  anticipación con que se renueva antes de `expire` (default 900)
+    TOKEN_RECHECK_SECONDS        cada cuánto se reintenta si el token sigue por vencer
+                                 tras una renovación fallida (default 30)
+    TOKEN_LOCK_TIMEOUT           segundos de espera por el lock de renovación (default 30)
+    CLIENT_ID / CLIENT_SECRET    credenciales de la aplicación en Multivende
+"""
+
+import os
+import json
+import logging
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from models import auth_app
+from database import get_engine, advisory_lock
+from token_crypto import encrypt, decrypt
+from multivende_client import MultivendeClient, get_client
+from dotenv import load_dotenv
+load_dotenv()
+
+SECRET_KEY = os.getenv("SECRET_KEY")
+CLIENT_ID = os.getenv("CLIENT_ID")
+CLIENT_SECRET = os.getenv("CLIENT_SECRET")
+TOKEN_REFRESH_AHEAD_SECONDS = int(os.getenv("TOKEN_REFRESH_AHEAD_SECONDS", "900"))
+TOKEN_RECHECK_SECONDS = int(os.getenv("TOKEN_RECHECK_SECONDS", "30"))
+TOKEN_LOCK_TIMEOUT = int(os.getenv("TOKEN_LOCK_TIMEOUT", "30"))
+TOKEN_LOCK_NAME = "multivende_token_refresh"
+# Horas desde `expire` en que el refresh token sigue siendo utilizable
+TOKEN_GRACE_HOURS = 6
+
+logger = logging.getLogger(__name__)
+
+
+class TokenUnavailable(RuntimeError):
+    """No hay token en `auth` o el último venció hace más de TOKEN_GRACE_HOURS."""
+
+
+class TokenRefreshError(RuntimeError):
+    """Multivende rechazó la renovación del token."""
+
+
+class TokenProvider:
+    """
+    Cache en proceso del bearer token desencriptado, con renovación anticipada.
+
+    Args:
+        secret_key: llave Fernet con la que se guarda el token.
+        refresh_ahead_seconds: anticipación con que se renueva antes de `expire`.
+        recheck_seconds: vigencia del cache para un token que no se pudo renovar.
+        engine: engine de la tabla `auth` y del lock (default get_engine()).
+    """
+
+    def __init__(self, secret_key=SECRET_KEY, refresh_ahead_seconds=TOKEN_REFRESH_AHEAD_SECONDS,
+                 recheck_seconds=TOKEN_RECHECK_SECONDS, engine=None):
+        self.secret_key = secret_key
+        self.ahead = timedelta(seconds=refresh_ahead_seconds)
+        self.recheck = timedelta(seconds=recheck_seconds)
+        self.engine = engine
+        self.expire = None
+        self.reloads = 0
+        self.refreshes = 0
+        self._token = None
+        self._valid_until = datetime.min
+        self._oauth_client = None
+        self._lock = threading.RLock()
+
+    def get(self):
+        """Retorna el token vigente. Lanza TokenUnavailable si no hay uno utilizable."""
+        token = self._token
+        if token is not None and datetime.now() < self._valid_until:
+            return token
+        with self._lock:
+            if self._token is None or datetime.now() >= self._valid_until:
+                self._load()
+            return self._token
+
+    def invalidate(self, token=None):
+        """
+        Descarta el token cacheado (por ejemplo ante un 401).
+
+        Si se entrega `token`, solo se descarta cuando sigue siendo el cacheado, para
+        que varios 401 concurrentes del token anterior provoquen una sola recarga.
+        """
+        with self._lock:
+            if token is None or token == self._token:
+                self._token = None
+
+    def refresh(self, force=False):
+        """
+        Renueva el token con el refresh token de la fila más reciente de `auth`.
+
+        Corre bajo un lock entre procesos. Si al obtenerlo la fila más reciente ya
+        no está por vencer, otro proceso la renovó y solo se carga (salvo `force`).
+        Retorna True si este proceso hizo la renovación. Lanza TokenUnavailable si
+        no hay token y TokenRefreshError si Multivende rechaza la renovación.
+        """
+        with self._lock, advisory_lock(TOKEN_LOCK_NAME, TOKEN_LOCK_TIMEOUT, engine=self._engine()):
+            last_auth = self._newest()
+            if last_auth is None:
+                raise TokenUnavailable("Failed authentication")
+            if not force and not self._needs_refresh(last_auth.expire):
+                self._cache(decrypt(last_auth.token, self.secret_key), last_auth.expire)
+                return False
+
+            payload = {
+                "client_id": CLIENT_ID,
+                "client_secret": CLIENT_SECRET,
+                "grant_type": "refresh_token",
+                "refresh_token": last_auth.refresh_token,
+            }
+            headers = {
+                'cache-control': 'no-cache',
+                'Content-Type': 'application/json'
+            }
+            response = self._oauth().post("/oauth/access-token", headers=headers, data=json.dumps(payload))
+            try:
+                data = response.json()
+                token, expire = data["token"], datetime.fromisoformat(data["expiresAt"]).replace(tzinfo=None)
+                refresh_token = data["refreshToken"]
+            except Exception as e:
+                raise TokenRefreshError(f"Hubo un error con la actualizacion {e}: {response.text[:200]}")
+
+            with Session(self._engine()) as session:
+                session.add(auth_app(token=encrypt(token, self.secret_key), expire=expire,
+                                     refresh_token=refresh_token))
+                session.commit()
+            self.refreshes += 1
+            self._cache(token, expire)
+            logger.info("Token de Multivende renovado, vence %s", expire)
+            return True
+
+    def _engine(self):
+        return self.engine or get_engine()
+
+    def _oauth(self):
+        # Cliente propio sin provider: el compartido pediría el token a este mismo provider
+        if self._oauth_client is None:
+            self._oauth_client = MultivendeClient()
+        return self._oauth_client
+
+    def _newest(self):
+        with Session(self._engine()) as session:
+            return session.scalar(select(auth_app).order_by(auth_app.expire.desc()))
+
+    def _needs_refresh(self, expire):
+        return expire - datetime.now() < self.ahead
+
+    def _cache(self, token, expire):
+        now = datetime.now()
+        self._token = token
+        self.expire = expire
+        self.reloads += 1
+        valid_until = expire - self.ahead
+        # Un token por vencer que no se pudo renovar se vuelve a revisar seguido
+        self._valid_until = valid_until if valid_until > now else now + self.recheck
+
+    def _load(self):
+        last_auth = self._newest()
+        if last_auth is None:
+            raise TokenUnavailable("Failed authentication")
+        if self._needs_refresh(last_auth.expire):
+            try:
+                self.refresh()
+                return
+            except (TokenRefreshError, TimeoutError) as e:
+                logger.warning("No se pudo renovar el token, se usa el vigente: %s", e)
+        # The token expired
+        if datetime.now() - last_auth.expire > timedelta(hours=TOKEN_GRACE_HOURS):
+            raise TokenUnavailable("Refresh token expired.")
+        self._cache(decrypt(last_auth.token, self.secret_key), last_auth.expire)
+
+
+# Provider compartido por proceso (webhook y jobs)
+_provider = None
+_provider_lock = threading.Lock()
+
+
+def get_token_provider() -> TokenProvider:
+    """Retorna el TokenProvider del proceso, creándolo en la primera llamada."""
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                _provider = TokenProvider()
+    return _provider
+
+
+def authorized_client():
+    """
+    Retorna el MultivendeClient del proceso autenticado con el token cacheado.
+
+    Renueva el token si está por vencer. Lanza TokenUnavailable si no hay un
+    token utilizable en `auth`.
+    """
+    provider = get_token_provider()
+    client = get_client(provider.get())
+    client.token_provider = provider
+    return client
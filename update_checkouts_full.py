@@ -1,5 +1,5 @@
 import logging
-from sqlalchemy import select, create_engine
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 import os
 import sys
@@ -8,9 +8,13 @@ import requests
 import time
 from datetime import datetime, timedelta
 from models import auth_app, checkouts_full, checkout_items
-import pandas as pd
-import numpy as np
+from database import get_engine
 from utils import *
+from token_provider import authorized_client, TokenUnavailable
+from checkout_parser import parse_checkout
+from supabase_outbox import OutboxRelay
+from multivende_client import get_client, fetch_many, MULTIVENDE_WORKERS
+from watermarks import incremental_since, set_watermark
 from dotenv import load_dotenv
 load_dotenv(override=True)
 
@@ -21,6 +25,8 @@ SECRET_KEY = os.getenv("SECRET_KEY")
 MERCHANT_ID = os.getenv("MERCHANT_ID")
 DAYS_TO_FETCH = os.getenv("DAYS") 
 CSV_FILE = f"{LOGS_PATH}/checkouts_log.csv"
+CHECKOUT_WORKERS = int(os.getenv("CHECKOUT_WORKERS", MULTIVENDE_WORKERS))
+JOB_NAME = "update_checkouts_full"
 
 #writeCsvLog(CSV_FILE, "INFO", "Job started", "Update checkouts full job has succesfully started")
 
@@ -31,18 +37,11 @@ logging.basicConfig(format='%(asctime)s: %(message)s', stream=sys.stdout,
                     level=logging.INFO)
 
 # Making engine
-engine = create_engine(SQLALCHEMY_DATABASE_URI,
-                        pool_recycle=3600,   # recycle connections every hour
-                        pool_pre_ping=True,
-                        connect_args={
-                            "ssl_ca": ssl
-                            }
-                        )
+engine = get_engine()
 # Get data from tables
 #writeCsvLog(CSV_FILE, "INFO", "DB Initializing", "The db session is initializing")
 logger.info('Retrieving data from db.')
 with Session(engine) as session:
-    last_auth = session.scalar(select(auth_app).order_by(auth_app.expire.desc()))
     result = session.scalar(select(checkouts_full).order_by(checkouts_full.fecha.desc()))
     now_add = datetime.now() + timedelta(days=2)
     now = now_add.strftime("%Y-%m-%dT%H:%M:%S")
@@ -50,36 +49,33 @@ with Session(engine) as session:
     last = last_update.strftime("%Y-%m-%dT%H:%M:%S")
 #writeCsvLog(CSV_FILE, "INFO", "DB Initialized", "The db session has been initialized")
 
-print("From:" + now + " To " + last)
-
-if last_auth == None:
-    logger.error("Failed authentication")
-    #writeCsvLog(CSV_FILE, "ERROR", "Failed authentication", "Please review the auth data")
-    sys.exit(0)
-#print("Last Auth Expire ", last_auth.expire)
-
-diff = datetime.now() - last_auth.expire
-# The token expired
-if diff.total_seconds()/3600 > 6:
-    logger.warning('Refresh token expired.')
-    #writeCsvLog(CSV_FILE, "WARNING", "Refresh token expired", "Please review the refresh token an try again")
+# Modo incremental: solo checkouts actualizados desde el ultimo watermark.
+# Sin watermark previo o con --full / FULL_SYNC=1 se usa la ventana completa.
+run_started = datetime.now()
+since = incremental_since(engine, JOB_NAME)
+if since is None:
+    window = f"_sold_at_from={last}&_sold_at_to={now}"
+    print("From:" + now + " To " + last)
+else:
+    window = f"_updated_at_from={since.strftime('%Y-%m-%dT%H:%M:%S')}&_updated_at_to={now}"
+    logger.info(f"Sincronizacion incremental desde {since}")
+
+# Token desencriptado desde auth (ver token_provider.py)
+try:
+    client = authorized_client()
+except TokenUnavailable as e:
+    logger.warning(str(e))
     sys.exit(0)
 
-# Decrypt token
-token = decrypt(last_auth.token, SECRET_KEY)
-
 # Get checkouts data
 logger.info('Recolectando datos de ventas')
 #writeCsvLog(CSV_FILE, "INFO", "Getting checkouts", "Calling the Multivende API to get the checkouts")
 merchant_id = MERCHANT_ID
-#url = f"https://app.multivende.com/api/m/{merchant_id}/checkouts/light/p/1?_created_at_from={last}&_created_at_to={now}"
-url = f"https://app.multivende.com/api/m/{merchant_id}/checkouts/light/limit/50?_sold_at_from={last}&_sold_at_to={now}"
-headers = {
-        'Authorization': f'Bearer {token}'
-}
+#url = f"/api/m/{merchant_id}/checkouts/light/p/1?_created_at_from={last}&_created_at_to={now}"
+url = f"/api/m/{merchant_id}/checkouts/light/limit/50?{window}"
 
 # Get id data from the checkouts
-response = requests.request("GET", url, headers=headers)
+response = client.get(url)
 try:
     response = response.json()
 except Exception as e:
@@ -90,17 +86,18 @@ except Exception as e:
 #pages = response["pagination"]["total_pages"]
 scroll_id = response["pagination"]["scroll_id"]
 print("Scroll id: ", scroll_id)
-ids= []
+# id -> updatedAt de la entrada light, mantiene el orden del listado
+light_updated = {}
 
 for d in response["entries"]:
-        ids.append(d["_id"])
+        light_updated[d["_id"]] = d.get("updatedAt")
 
 # Extract all ids
 logger.info('Cargando ids de ventas.')
 while scroll_id is not None:
-    #url = f"https://app.multivende.com/api/m/{merchant_id}/checkouts/light/p/{p+1}?_updated_at_from={last}&_updated_at_to={now}"
-    url = f"https://app.multivende.com/api/m/{merchant_id}/checkouts/light/limit/500?_sold_at_from={last}&_sold_at_to={now}&_scroll_id={scroll_id}"
-    data = requests.get(url, headers=headers)
+    #url = f"/api/m/{merchant_id}/checkouts/light/p/{p+1}?_updated_at_from={last}&_updated_at_to={now}"
+    url = f"/api/m/{merchant_id}/checkouts/light/limit/500?{window}&_scroll_id={scroll_id}"
+    data = client.get(url)
     try:
         data = data.json()
         scroll_id = data["pagination"]["scroll_id"]
@@ -108,127 +105,67 @@ while scroll_id is not None:
         logger.error(f'Hubo un error {e}: {response.text}')
     
     for d in data["entries"]:
-        ids.append(d["_id"])
+        light_updated[d["_id"]] = d.get("updatedAt")
+
+ids = list(light_updated)
+
+# Solo descargamos el detalle de los checkouts nuevos o modificados desde la
+# ultima vez que se guardaron
+stored_updated = get_checkouts_full_updated_at(engine, ids)
+ids = [id for id in ids if is_newer(parse_api_datetime(light_updated[id]), stored_updated.get(id))]
+logger.info(f"Checkouts sin cambios omitidos: {len(light_updated) - len(ids)}")
+# La boleta no mueve el updatedAt: las ventas de la ventana con la boleta aun
+# sin sincronizar se vuelven a descargar en cada run, como antes del filtro
+selected = set(ids)
+pending_billing = [id for id in get_pending_billing_ids(engine, last_update) if id not in selected]
+ids += pending_billing
+logger.info(f"Checkouts con boleta pendiente a revisar: {len(pending_billing)}")
 
 # Now the information completed
 logger.info('Cargando informacion de ventas.')
 #writeCsvLog(CSV_FILE, "INFO", "Total checkouts", f"Total checkouts retrieved in API call {len(ids)}")
 logger.info(f"Total checkouts retrieved in API call {len(ids)}")
 
-ventas = []
-productos = []
-count = 0
-
 print("Id totales: ", len(ids))
 
 # dfid = pd.DataFrame(ids)
 # dfid.to_csv("ids_dataframe.csv")
 
 
+def load_checkout(id):
+    """Descarga un checkout y su boleta, retornando la venta y sus items."""
+    venta, items = parse_checkout(*fetch_checkout(client, id))
+    # El updatedAt del listado light es el que compara el proximo run
+    venta.updated_at = parse_api_datetime(light_updated.get(id)) or venta.updated_at
+    return venta, items
 
-for id in ids:
-    tmp = {}
-    url = f"https://app.multivende.com/api/checkouts/{id}"
-    checkout = requests.get(url, headers=headers)
-    try:
-        checkout = checkout.json()
-        checkout['soldAt']
-        count = count + 1
-        #print("Checkout agregado, cuenta: ", count)
-        #print(checkout)
-        #print("\n\n")
-    except Exception as e:
-        logger.error(f"Error {e}: {checkout}")
-        
-    tmp["fecha"] = checkout["soldAt"]
-    tmp["nombre"] = checkout["Client"]["fullName"]
-    tmp["n venta"] = checkout["CheckoutLink"]["externalOrderNumber"] # Numero de orden en marketplace
-    tmp["id"] = checkout["CheckoutLink"]["CheckoutId"] # Codigo en multivende
-    tmp["estado entrega"] = checkout["deliveryStatus"]
-    tmp["costo de envio"] = checkout["DeliveryOrderInCheckouts"][0]["DeliveryOrder"]["cost"]
-    tmp["market"] = checkout["origin"]
-    tmp["mail"] = checkout["Client"]["email"]
-    tmp["phone"] = checkout["Client"]["phoneNumber"]
-    # Try to find the billing files
-    try:
-        url = f"https://app.multivende.com/api/checkouts/{id}/electronic-billing-documents/p/1"
-        billing = requests.get(url, headers=headers).json()
-        tmp["estado boleta"] = billing["entries"][-1]["ElectronicBillingDocumentFiles"][-1]["synchronizationStatus"]
-        tmp["url boleta"] = billing["entries"][-1]["ElectronicBillingDocumentFiles"][-1]["url"]
-    except:
-        tmp["estado boleta"] = None
-        tmp["url boleta"] = None
-        
-    # Getting all status of ventas
-    tmp["estado venta"] = []
-    for status in checkout["CheckoutPayments"]:
-        tmp["estado venta"].append(status["paymentStatus"])
-    # Campos agregados
-    tmp['fecha promesa'] = checkout['DeliveryOrderInCheckouts'][0]['DeliveryOrder']['promisedDeliveryDate']
-    try:
-        tmp['direccion'] = checkout['DeliveryOrderInCheckouts'][0]['DeliveryOrder']['deliveryAddress'][0:79]
-    except (TypeError, KeyError, IndexError):
-        tmp['direccion'] = None  # or some default value like ""
-    tmp['codigo'] = checkout['DeliveryOrderInCheckouts'][0]['DeliveryOrder']['code']
-    tmp['courier'] = checkout['DeliveryOrderInCheckouts'][0]['DeliveryOrder']['courierName']
-    tmp['clase de envio'] = checkout['DeliveryOrderInCheckouts'][0]['DeliveryOrder']['shippingMode']
-    tmp['fecha despacho'] = checkout['DeliveryOrderInCheckouts'][0]['DeliveryOrder']['handlingDateLimit']
-    tmp['delivery status'] = checkout['DeliveryOrderInCheckouts'][0]['DeliveryOrder']['deliveryStatus']
-    n_seguimiento = checkout['DeliveryOrderInCheckouts'][0]['DeliveryOrder']['trackingNumber']
-    print("N Seguimiento", n_seguimiento) 
-    if n_seguimiento and len(n_seguimiento) == 21:
-        tmp['N seguimiento'] = n_seguimiento[3:-7]
-    elif n_seguimiento != None:
-        if len(n_seguimiento) != 36:
-            tmp['N seguimiento'] = n_seguimiento
-    tmp['status etiqueta'] = checkout['DeliveryOrderInCheckouts'][0]['DeliveryOrder']['shippingLabelStatus']
-    tmp['estado impresion etiqueta'] = checkout['DeliveryOrderInCheckouts'][0]['DeliveryOrder']['shippingLabelPrintStatus']
-    tmp['id venta'] = checkout['_id']
-    tmp['codigo venta'] = checkout['code']
-
-    ventas.append(tmp)
-    
-    # For each item we split the checkout
-    for product in checkout["CheckoutItems"]:
-        item = {
-        "codigo producto": product["code"],
-        "nombre producto": product["ProductVersion"]["Product"]["name"],
-        "id padre producto": product["ProductVersion"]["ProductId"],
-        "id hijo producto": product["ProductVersionId"],
-        "cantidad": product["count"],
-        "precio": product["totalWithDiscount"],
-        "id venta": checkout["CheckoutLink"]["CheckoutId"]
-        }
-        productos.append(item)
-
-dfp = pd.DataFrame(productos)
-
-
-# Load data to be processed
-# logger.info('Limpiando los datos.')
-df = pd.DataFrame(ventas)
-df["fecha"] = pd.to_datetime(df["fecha"])
-df["fecha"] = df["fecha"].dt.tz_convert(None)
-
-df.fillna(np.nan, inplace=True)
-
-# Fill empty couriers
-df['courier'].fillna('Empty', inplace=True)
-df["fecha despacho"] = pd.to_datetime(df["fecha despacho"])
-df["fecha despacho"] = df["fecha despacho"].dt.tz_convert(None)
-df["fecha promesa"] = pd.to_datetime(df["fecha promesa"])
-df["fecha promesa"] = df["fecha promesa"].dt.tz_convert(None)
-df= df.fillna(np.nan)
-for i in df["estado venta"].index:
-    df.loc[i, "estado venta"] = df["estado venta"][i][-1]
-    
-df = df.replace({np.NaN: None})
 
-#df.to_csv("checkouts_full.csv")
+# Descarga concurrente, los resultados mantienen el orden de ids
+logger.info(f"Descargando detalle con {CHECKOUT_WORKERS} workers.")
+# Los checkouts que fallaron quedan en None y se omiten
+ventas = [result for result in fetch_many(load_checkout, ids, workers=CHECKOUT_WORKERS) if result is not None]
+logger.info(f"Checkouts descargados {len(ventas)} de {len(ids)}")
+
+if len(ids) == 0:
+    set_watermark(engine, JOB_NAME, run_started)
+    logger.info("No hay checkouts nuevos o actualizados.")
+    sys.exit(0)
+if len(ventas) == 0:
+    logger.error("No se pudo descargar ningun checkout.")
+    sys.exit(0)
 
 logger.info('Cargando a la DB.')
-check_difference_and_update_checkouts_full(df, checkouts_full, engine)
-check_difference_and_update_checkout_items(dfp, checkout_items, engine)
+# MySQL y el outbox de Supabase se escriben en la misma transaccion por lote
+write_checkouts(ventas, engine)
+# Envia a Supabase lo que quedo en el outbox; si el relay del webhook tiene el
+# lock, lo envia el
+logger.info(f"Filas del outbox enviadas a Supabase: {OutboxRelay(engine=engine).drain()}")
+# Solo avanzamos el watermark si no hubo checkouts fallidos, asi el proximo
+# run vuelve a pedirlos
+if len(ventas) == len(ids):
+    set_watermark(engine, JOB_NAME, run_started)
+else:
+    logger.warning(f"{len(ids) - len(ventas)} checkouts fallaron, el watermark no se actualiza.")
 et = time.time()
 elapsed_time = et - st
 logger.info(f"This job has been completed succesfully in {elapsed_time} seconds")
@@ -1,13 +1,16 @@
 import logging
-from sqlalchemy import select, create_engine, update
+from sqlalchemy import select, update
 from sqlalchemy.orm import Session
 import os
 import sys
 import json
 import requests
 from models import auth_app, ids, customs_ids
+from database import get_engine
 from datetime import datetime
+import pandas as pd
 from utils import *
+from token_provider import get_token_provider, TokenUnavailable
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -26,31 +29,17 @@ logging.basicConfig(format='%(asctime)s: %(message)s', stream=sys.stdout,
                     level=logging.INFO)
 
 # Making engine
-engine = create_engine(SQLALCHEMY_DATABASE_URI,
-                        pool_recycle=3600,   # recycle connections every hour
-                        pool_pre_ping=True,
-                        connect_args={
-                            "ssl_ca": ssl
-                            }
-                        )
+engine = get_engine()
 # Get data from tables
 logger.info('Retrieving data from db.')
-with Session(engine) as session:
-    last_auth = session.scalar(select(auth_app).order_by(auth_app.expire.desc()))
 
-if last_auth == None:
-    logger.error("Failed authentication")
-    sys.exit(0)
-        
-diff = datetime.utcnow() - last_auth.expire
-# The token expired
-if diff.total_seconds()/3600 > 6:
-    logger.warning('Refresh token expired.')
+# Token desencriptado desde auth (ver token_provider.py)
+try:
+    token = get_token_provider().get()
+except TokenUnavailable as e:
+    logger.warning(str(e))
     sys.exit(0)
 
-# Decrypt token
-token = decrypt(last_auth.token, SECRET_KEY)
-
 # Getting data from ids
 merchant_id = MERCHANT_ID
 logger.info("Getting data from brands")
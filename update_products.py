@@ -1,15 +1,18 @@
 import logging
-from sqlalchemy import select, create_engine
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 import os
 import sys
 import json
 import requests
 from models import auth_app, Product, Attributes
+from database import get_engine
 from datetime import datetime, timezone
+import pandas as pd
 from utils import *
+from token_provider import authorized_client, TokenUnavailable
+from multivende_client import get_client, fetch_many
 import json
-from time import sleep
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -21,6 +24,8 @@ SECRET_KEY = os.getenv("SECRET_KEY")
 MERCHANT_ID = os.getenv("MERCHANT_ID")
 DAYS_TO_FETCH = os.getenv("DAYS")
 CSV_FILE = f"{LOGS_PATH}/deliveries_log.csv"
+# "bulk": una pasada por bodega/lista de precios, "per_sku": una consulta por SKU
+STOCK_PRICE_MODE = os.getenv("STOCK_PRICE_MODE", "bulk")
 
 # Setting up logger
 logger = logging.getLogger(__name__)
@@ -28,41 +33,24 @@ logging.basicConfig(format='%(asctime)s: %(message)s', stream=sys.stdout,
                     level=logging.INFO)
 
 # Making engine
-engine = create_engine(SQLALCHEMY_DATABASE_URI,
-                        pool_recycle=3600,   # recycle connections every hour
-                        pool_pre_ping=True,
-                        connect_args={
-                            "ssl_ca": ssl
-                            }
-                        )
+engine = get_engine()
 
 # Get data from tables
 logger.info('Retrieving data from db.')
-with Session(engine) as session:
-    last_auth = session.scalar(select(auth_app).order_by(auth_app.expire.desc()))
 
-if last_auth == None:
-    logger.error("Failed authentication")
-    sys.exit(0)
-        
-diff = datetime.now(timezone.utc) - last_auth.expire.replace(tzinfo=timezone.utc)
-# The token expired
-if diff.total_seconds()/3600 > 6:
-    logger.warning('Refresh token expired.')
+# Token desencriptado desde auth (ver token_provider.py)
+try:
+    client = authorized_client()
+except TokenUnavailable as e:
+    logger.warning(str(e))
     sys.exit(0)
-
-# Decrypt token
-token = decrypt(last_auth.token, SECRET_KEY)
 #print(f"Token: ${token}")
 # Get products data
 logger.info('Recolectando datos de atributos')
 merchant_id = MERCHANT_ID
-url = f"https://app.multivende.com/api/m/{merchant_id}/all-product-attributes"
-headers = {
-        'Authorization': f'Bearer {token}'
-}
+url = f"/api/m/{merchant_id}/all-product-attributes"
 # Get data
-response = requests.request("GET", url, headers=headers)
+response = client.get(url)
     
 try:
     response = response.json()
@@ -82,28 +70,20 @@ att_names = [item["name"]+"-"+item["CustomAttributeSet.name"] for item in att]
     
 # Obtenemos la lista de todos los productos
 logger.info("Solicitando ids de productos")
-url = f"https://app.multivende.com/api/m/{merchant_id}/products/light/p/1"
-response = requests.request("GET", url, headers=headers).json()
-data = response["entries"]
-pages = response["pagination"]["total_pages"]
-# Los productos se organizan en paginas, pasamos por todas, guardando los resultados
-for p in range(pages-1):
-    url = f"https://app.multivende.com/api/m/{merchant_id}/products/light/p/{p+2}"
-    response = requests.request("GET", url, headers=headers).json()
-    data += response["entries"]
+# Los productos se organizan en paginas, las pedimos en paralelo manteniendo el orden
+data = client.get_all_pages(f"/api/m/{merchant_id}/products/light/p/{{page}}")
 
 # Extraemos los id de cada uno
 ids = [item["_id"] for item in data]
 
-logger.info("Pagins totales: %d", pages)
 logger.info("Total de productos: %d", len(ids))
 
 # Para cada producto, guardamos sus atributos
 logger.debug("Solicitando atributos de productos por ids.")
 data = []
 for i in ids:
-    url = f"https://app.multivende.com/api/products/{i}?_include_product_picture=true"
-    response = requests.request("GET", url, headers=headers).json()
+    url = f"/api/products/{i}?_include_product_picture=true"
+    response = client.get(url).json()
     data.append(response)
 
 # Dentro de los atributos normales, extraemos los atributos hechos por el usuario
@@ -213,41 +193,74 @@ for i in range(df.shape[0]):
 
 logger.info('Obteniendo precios y stock')
 # Obtenemos las listas de precios
-url = f'https://app.multivende.com/api/m/{MERCHANT_ID}/product-price-lists'
-headers = {
-        'Authorization': f'Bearer {token}'
-}
-price_lists = requests.request("GET", url, headers=headers).json()
+url = f'/api/m/{MERCHANT_ID}/product-price-lists'
+price_lists = client.get(url).json()
 
 # Obtenemos las bodegas
-url = f'https://app.multivende.com/api/m/{MERCHANT_ID}/stores-and-warehouses'
-warehouses = requests.request("GET", url, headers=headers).json()
+url = f'/api/m/{MERCHANT_ID}/stores-and-warehouses'
+warehouses = client.get(url).json()
 
 # Preparamos contenedores de datos
-stocks = []
-prices = pd.DataFrame(columns = [''.join(p['name'].split(' ')) + extra for extra in ['', 'WithDiscount'] for p in price_lists['entries']])
+price_names = [''.join(p['name'].split(' ')) for p in price_lists['entries']]
+prices = pd.DataFrame(columns = [name + extra for extra in ['', 'WithDiscount'] for name in price_names],
+                      index = df.index)
 
-for i, row in df.iterrows():
-    # Para cada producto obtenemos
-    for ware in warehouses['entries']:
-        url = f'https://app.multivende.com/api/product-stocks/stores-and-warehouses/{ware["_id"]}/limit/1000?_code={row["IDENTIFICADOR_HIJO"]}'
-        headers = {
-                'Authorization': f'Bearer {token}'
-        }
-        product_stock = requests.request("GET", url, headers=headers).json()
-        stocks.append(product_stock['entries'][0]['ProductStocks']['amount'])
-        
-    for list in price_lists['entries']:
-        url = f'https://app.multivende.com/api/product-price/product-price-lists/{list["_id"]}/limit/1000?_code={row["IDENTIFICADOR_HIJO"]}'
-        product_prices = requests.request("GET", url, headers=headers).json()
-        try:
-            prices.loc[i, ''.join(list['name'].split(' '))] = product_prices['entries'][0]['ProductPrices']['gross']
-            prices.loc[i, ''.join(list['name'].split(' ')) + 'WithDiscount'] = product_prices['entries'][0]['ProductPrices']['priceWithDiscount']
-        except:
-            print(product_prices)
-    
-    # Waiting time to avoid over-crowding connection    
-    sleep(0.01)
+if STOCK_PRICE_MODE == "bulk":
+    # Recorremos cada bodega y lista de precios una sola vez y armamos un
+    # indice SKU -> stock/precio que luego se cruza con la tabla de productos
+    def scan_index(path, extract):
+        index = {}
+        for entry in client.iter_scroll(path):
+            try:
+                value = extract(entry)
+            except (KeyError, TypeError):
+                # Version sin stock/precio asignado en esta bodega o lista
+                continue
+            # El filtro _code acepta tanto el id de la version como su codigo
+            for key in (entry.get('_id'), entry.get('code')):
+                if key:
+                    index[key] = value
+        return index
+
+    stock_paths = [f'/api/product-stocks/stores-and-warehouses/{ware["_id"]}/limit/1000'
+                   for ware in warehouses['entries']]
+    price_paths = [f'/api/product-price/product-price-lists/{list["_id"]}/limit/1000'
+                   for list in price_lists['entries']]
+    stock_indexes = fetch_many(lambda path: scan_index(path, lambda e: e['ProductStocks']['amount']),
+                               stock_paths)
+    price_indexes = fetch_many(lambda path: scan_index(path, lambda e: (e['ProductPrices']['gross'],
+                                                                        e['ProductPrices']['priceWithDiscount'])),
+                               price_paths)
+    if any(index is None for index in stock_indexes + price_indexes):
+        # Un indice incompleto dejaria SKUs sin stock ni precio
+        logger.error("No se pudo recorrer completas todas las bodegas y listas de precios.")
+        sys.exit(0)
+
+    skus = df["IDENTIFICADOR_HIJO"]
+    stocks = [sum(index.get(sku) or 0 for index in stock_indexes) for sku in skus]
+    for name, index in zip(price_names, price_indexes):
+        prices[name] = [index.get(sku, (None, None))[0] for sku in skus]
+        prices[name + 'WithDiscount'] = [index.get(sku, (None, None))[1] for sku in skus]
+    logger.info("Indices de stock y precios construidos para %d SKUs.", len(skus))
+else:
+    stocks = []
+    for i, row in df.iterrows():
+        # Para cada producto obtenemos
+        stock = 0
+        for ware in warehouses['entries']:
+            url = f'/api/product-stocks/stores-and-warehouses/{ware["_id"]}/limit/1000?_code={row["IDENTIFICADOR_HIJO"]}'
+            product_stock = client.get(url).json()
+            stock += product_stock['entries'][0]['ProductStocks']['amount']
+        stocks.append(stock)
+            
+        for list in price_lists['entries']:
+            url = f'/api/product-price/product-price-lists/{list["_id"]}/limit/1000?_code={row["IDENTIFICADOR_HIJO"]}'
+            product_prices = client.get(url).json()
+            try:
+                prices.loc[i, ''.join(list['name'].split(' '))] = product_prices['entries'][0]['ProductPrices']['gross']
+                prices.loc[i, ''.join(list['name'].split(' ')) + 'WithDiscount'] = product_prices['entries'][0]['ProductPrices']['priceWithDiscount']
+            except:
+                print(product_prices)
 
 # Se agregan a la tabla
 df['Stock'] = stocks
@@ -1,17 +1,19 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import select, update, create_engine
-from models import auth_app, checkouts_full, checkout_items
-from supabase_sync import sync_checkout
-from cryptography.fernet import Fernet
-import pandas as pd
-import numpy as np
+from sqlalchemy import select, insert, update, delete, tuple_, bindparam
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from models import auth_app, checkouts_full, checkout_items, association_table
+from database import get_engine, get_session
+from multivende_client import get_client
+from checkout_parser import parse_checkout, parse_api_datetime
+from token_crypto import encrypt, decrypt
+from token_provider import authorized_client, TokenUnavailable
 import logging
 import sys
-import requests
-import pytz
 import csv
 import os
-from datetime import datetime
+import json
+import hashlib
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -22,6 +24,90 @@ SECRET_KEY = os.getenv("SECRET_KEY")
 MERCHANT_ID = os.getenv("MERCHANT_ID")
 DAYS_TO_FETCH = os.getenv("DAYS") 
 CSV_FILE = f"/checkouts_log.csv"
+UPSERT_BATCH_SIZE = int(os.getenv("UPSERT_BATCH_SIZE", "500"))
+
+# Columna de checkouts_full -> columna del DataFrame de ventas
+CHECKOUTS_FULL_FIELDS = {
+    "costo_envio": "costo de envio",
+    "estado_boleta": "estado boleta",
+    "estado_entrega": "estado entrega",
+    "estado_venta": "estado venta",
+    "fecha": "fecha",
+    "mail": "mail",
+    "market": "market",
+    "n_venta": "n venta",
+    "nombre_cliente": "nombre",
+    "phone": "phone",
+    "url_boleta": "url boleta",
+    "n_seguimiento": "N seguimiento",
+    "codigo": "codigo",
+    "codigo_venta": "codigo venta",
+    "courier": "courier",
+    "clase_de_envio": "clase de envio",
+    "delivery_status": "delivery status",
+    "direccion": "direccion",
+    "impresion_etiqueta": "estado impresion etiqueta",
+    "fecha_despacho": "fecha despacho",
+    "fecha_promesa": "fecha promesa",
+    "id_venta": "id venta",
+    "status_etiqueta": "status etiqueta",
+    "updated_at": "updated at",
+}
+
+# Columna de products -> columna del DataFrame de productos
+PRODUCTS_FIELDS = {
+    "id_padre": "IDENTIFICADOR_PADRE",
+    "id_hijo": "IDENTIFICADOR_HIJO",
+    "season": "Season",
+    "model": "model",
+    "description": "description",
+    "htmlDescription": "htmlDescription",
+    "shortDescription": "shortDescription",
+    "htmlShortDescription": "htmlShortDescription",
+    "warranty": "Warranty",
+    "brand": "Brand",
+    "name": "name",
+    "productCategory": "ProductCategory",
+    "skuName": "sku_name",
+    "color": "color",
+    "size": "size",
+    "sku": "sku",
+    "internalSku": "internalSku",
+    "width": "width",
+    "length": "length",
+    "height": "height",
+    "weight": "weight",
+    "tags": "tags",
+    "picture": "picture url",
+}
+
+# Columna de deliverys -> columna del DataFrame de despachos
+DELIVERYS_FIELDS = {
+    "n_seguimiento": "N seguimiento",
+    "codigo": "codigo",
+    "codigo_venta": "codigo venta",
+    "courier": "courier",
+    "clase_de_envio": "clase de envio",
+    "delivery_status": "delivery status",
+    "direccion": "direccion",
+    "impresion_etiqueta": "estado impresion etiqueta",
+    "fecha_despacho": "fecha despacho",
+    "fecha_promesa": "fecha promesa",
+    "id_venta": "id venta",
+    "status_etiqueta": "status etiqueta",
+    "n_venta": "n venta",
+}
+
+# Columna de checkout_items -> columna del DataFrame de productos
+CHECKOUT_ITEMS_FIELDS = {
+    "codigo_producto": "codigo producto",
+    "nombre_producto": "nombre producto",
+    "id_padre_producto": "id padre producto",
+    "id_hijo_producto": "id hijo producto",
+    "cantidad": "cantidad",
+    "precio": "precio",
+    "id_venta": "id venta",
+}
 
 
 # Setting up logger
@@ -29,150 +115,156 @@ logger = logging.getLogger(__name__)
 logging.basicConfig(format='%(asctime)s: %(message)s', stream=sys.stdout,
                     level=logging.INFO)
 
-def webhook_load_checkout(id):
-    engine = create_engine(SQLALCHEMY_DATABASE_URI,
-                        pool_recycle=3600,   # recycle connections every hour
-                        pool_pre_ping=True,
-                        connect_args={
-                            "ssl_ca": ssl
-                            }
-                        )
-    with Session(engine) as session:
-        last_auth = session.scalar(select(auth_app).order_by(auth_app.expire.desc()))
-    
-    #rint(last_auth.expire)
+def fetch_webhook_checkout(id):
+    """Descarga un checkout y sus documentos de Multivende.
 
-    if last_auth == None:
-        logger.error("Failed authentication")
-        sys.exit(0)
-    
-    diff = datetime.now() - last_auth.expire
-    # The token expired
-    if diff.total_seconds()/3600 > 6:
-        logger.warning('Refresh token expired.')
-        sys.exit(0)
+    Input : 
+    ---------
+      *  id : str. ID del checkout en Multivende.
 
-    # Decrypt token
-    token = decrypt(last_auth.token, SECRET_KEY)
+    Output :
+    ---------
+      * tuple. (venta, productos): CheckoutRecord del checkout y lista de ItemRecord con
+      sus items (ver checkout_parser.py). Lanza TokenUnavailable si no hay
+      un token utilizable, para que la cola reintente el evento.
+    """
+    # Token desencriptado y cacheado por proceso (ver token_provider.py)
+    client = authorized_client()
+    try:
+        checkout, billing = fetch_checkout(client, id)
+    except ValueError as e:
+        logger.error(str(e))
+        raise
+    return parse_checkout(checkout, billing)
 
-    headers = {
-        'Authorization': f'Bearer {token}'
-    }
+def fetch_checkout(client, id, with_billing=True):
+    """Descarga el JSON de un checkout y, opcionalmente, el de su boleta.
 
-    ventas = []
-    productos = []
+    Input : 
+    ---------
+      *  client : MultivendeClient. Cliente autenticado (ver multivende_client.py).
+      *  id : str. ID del checkout en Multivende.
+      *  with_billing : bool. Si es False no se pide la boleta.
 
-    tmp = {}
-    url = f"https://app.multivende.com/api/checkouts/{id}"
-    checkout = requests.get(url, headers=headers, timeout=10)
+    Output :
+    ---------
+      * tuple. (checkout, billing). billing es None si no se pidio o no existe.
+      Lanza ValueError si la respuesta del checkout no es valida.
+    """
+    checkout = client.get(f"/api/checkouts/{id}")
     try:
         checkout = checkout.json()
         checkout['soldAt']
-        #count = count + 1
     except Exception as e:
-        logger.error(f"Error {e}: {checkout}")
-        
-    tmp["fecha"] = checkout["soldAt"]
-    tmp["nombre"] = checkout["Client"]["fullName"]
-    tmp["n venta"] = checkout["CheckoutLink"]["externalOrderNumber"] # Numero de orden en marketplace
-    tmp["id"] = checkout["CheckoutLink"]["CheckoutId"] # Codigo en multivende
-    tmp["estado entrega"] = checkout["deliveryStatus"]
-    tmp["costo de envio"] = checkout["DeliveryOrderInCheckouts"][0]["DeliveryOrder"]["cost"]
-    tmp["market"] = checkout["origin"]
-    tmp["mail"] = checkout["Client"]["email"]
-    tmp["phone"] = checkout["Client"]["phoneNumber"]
-    # Try to find the billing files
-    try:
-        url = f"https://app.multivende.com/api/checkouts/{id}/electronic-billing-documents/p/1"
-        billing = requests.get(url, headers=headers).json()
-        tmp["estado boleta"] = billing["entries"][-1]["ElectronicBillingDocumentFiles"][-1]["synchronizationStatus"]
-        tmp["url boleta"] = billing["entries"][-1]["ElectronicBillingDocumentFiles"][-1]["url"]
-    except:
-        tmp["estado boleta"] = None
-        tmp["url boleta"] = None
-        
-    # Getting all status of ventas
-    tmp["estado venta"] = []
-    for status in checkout["CheckoutPayments"]:
-        tmp["estado venta"].append(status["paymentStatus"])
-    # Campos agregados
-    if checkout['DeliveryOrderInCheckouts'][0]['DeliveryOrder']['promisedDeliveryDate'] == None:
-        tmp['fecha promesa'] = '2262-04-11 23:47:16.854775Z'
-    else:
-        tmp['fecha promesa'] = checkout['DeliveryOrderInCheckouts'][0]['DeliveryOrder']['promisedDeliveryDate']
-    try:
-        tmp['direccion'] = checkout['DeliveryOrderInCheckouts'][0]['DeliveryOrder']['deliveryAddress'][0:79]
-    except (TypeError, KeyError, IndexError):
-        tmp['direccion'] = None  # or some default value like ""
-    tmp['codigo'] = checkout['DeliveryOrderInCheckouts'][0]['DeliveryOrder']['code']
-    tmp['courier'] = checkout['DeliveryOrderInCheckouts'][0]['DeliveryOrder']['courierName']
-    tmp['clase de envio'] = checkout['DeliveryOrderInCheckouts'][0]['DeliveryOrder']['shippingMode']
-    tmp['fecha despacho'] = checkout['DeliveryOrderInCheckouts'][0]['DeliveryOrder']['handlingDateLimit']
-    tmp['delivery status'] = checkout['DeliveryOrderInCheckouts'][0]['DeliveryOrder']['deliveryStatus']
-    n_seguimiento = checkout['DeliveryOrderInCheckouts'][0]['DeliveryOrder']['trackingNumber']
-    print("N Seguimiento", n_seguimiento) 
-    if n_seguimiento and len(n_seguimiento) == 21:
-        tmp['N seguimiento'] = n_seguimiento[3:-7]
-    elif n_seguimiento != None:
-        if len(n_seguimiento) != 36:
-            tmp['N seguimiento'] = n_seguimiento
-        else:  
-            tmp['N seguimiento'] = None
-    tmp['status etiqueta'] = checkout['DeliveryOrderInCheckouts'][0]['DeliveryOrder']['shippingLabelStatus']
-    tmp['estado impresion etiqueta'] = checkout['DeliveryOrderInCheckouts'][0]['DeliveryOrder']['shippingLabelPrintStatus']
-    tmp['id venta'] = checkout['_id']
-    tmp['codigo venta'] = checkout['code']
-
-    ventas.append(tmp)
-    
-    # For each item we split the checkout
-    for product in checkout["CheckoutItems"]:
-        item = {
-        "codigo producto": product["code"],
-        "nombre producto": product["ProductVersion"]["Product"]["name"],
-        "id padre producto": product["ProductVersion"]["ProductId"],
-        "id hijo producto": product["ProductVersionId"],
-        "cantidad": product["count"],
-        "precio": product["totalWithDiscount"],
-        "id venta": checkout["CheckoutLink"]["CheckoutId"]
-        }
-        productos.append(item)
-
-    #Crear dataframes
-    print("Ventas a cargar: \n\n", ventas)
-
-    df = pd.DataFrame(ventas)
-    dfp = pd.DataFrame(productos)
-
-    df["fecha"] = pd.to_datetime(df["fecha"])
-    df["fecha"] = df["fecha"].dt.tz_convert(None)
-
-    df.fillna(np.nan, inplace=True)
-
-    # Fill empty couriers
-    df['courier'].fillna('Empty', inplace=True)
-    df["fecha despacho"] = pd.to_datetime(df["fecha despacho"])
-    df["fecha despacho"] = df["fecha despacho"].dt.tz_convert(None)
-    df["fecha promesa"] = pd.to_datetime(df["fecha promesa"])
-    df["fecha promesa"] = df["fecha promesa"].dt.tz_convert(None)
-    df= df.fillna(np.nan)
-    for i in df["estado venta"].index:
-        df.loc[i, "estado venta"] = df["estado venta"][i][-1]
-        
-    df = df.replace({np.NaN: None})
+        raise ValueError(f"Error {e}: {checkout.text[:200]}")
+    billing = None
+    if with_billing:
+        # Try to find the billing files
+        try:
+            billing = client.get_json(f"/api/checkouts/{id}/electronic-billing-documents/p/1")
+        except Exception:
+            billing = None
+    return checkout, billing
 
-    check_difference_and_update_checkouts_full(df, checkouts_full, engine)
-    check_difference_and_update_checkout_items(dfp, checkout_items, engine)
+def write_checkouts(results, engine=None, batch_size=UPSERT_BATCH_SIZE):
+    """Carga en MySQL checkouts ya parseados y los deja en el outbox de Supabase.
 
-    # Dual-write: sync a Supabase de inmediato (sin esperar novy-upsert cron)
-    try:
-        sync_checkout(tmp, productos)
-    except Exception as e:
-        logger.warning('[SupabaseSync] Error en sync — MySQL write OK, continuando: %s', e)
+    Cada lote de `batch_size` checkouts escribe checkouts_full, checkout_items y
+    el outbox en una sola transaccion; el relay de supabase_outbox.py los envia
+    a Supabase despues, fuera del camino del webhook y de los jobs.
+
+    Input : 
+    ---------
+      *  results : list. Tuplas (CheckoutRecord, [ItemRecord]) de parse_checkout.
 
-    return True
+      *  engine : SQLAlchemy.Engine. Opcional, por defecto get_engine().
+
+      *  batch_size : int. Checkouts por transaccion.
+
+    Output :
+    ---------
+      * dict. tabla -> (insertados, actualizados, sin cambios).
+    """
+    from supabase_sync import is_enabled
+    from supabase_outbox import enqueue
+
+    engine = engine or get_engine()
+    counters = {"checkouts_full": [0, 0, 0], "checkout_items": [0, 0, 0]}
+    logger.info(f"Ventas a cargar: {len(results)} Items: {sum(len(items) for _, items in results)}")
+    for i in range(0, len(results), batch_size):
+        batch = results[i:i + batch_size]
+        ventas = [venta.as_dict() for venta, _ in batch]
+        productos = [item.as_dict() for _, items in batch for item in items]
+        with engine.begin() as conn:
+            written = {"checkouts_full": _bulk_upsert(conn, checkouts_full.__table__, ventas, ["id_venta"])}
+            if productos:
+                written["checkout_items"] = _bulk_upsert(conn, checkout_items.__table__, productos,
+                                                         ["id_venta", "id_hijo_producto"])
+            # Dual-write: el outbox se confirma junto con MySQL
+            if is_enabled():
+                enqueue(conn, batch)
+        for table, result in written.items():
+            counters[table] = [total + n for total, n in zip(counters[table], result)]
+    for table, result in counters.items():
+        logger.info("%s: rows inserted %d rows updated %d rows unchanged %d", table, *result)
+    return {table: tuple(result) for table, result in counters.items()}
+
+def is_newer(updated_at, stored_updated_at):
+    """True si el checkout cambio respecto de lo guardado o no se puede saber.
+
+    MySQL guarda DATETIME sin fraccion de segundo, por eso se compara truncando.
+    """
+    if updated_at is None or stored_updated_at is None:
+        return True
+    return updated_at.replace(microsecond=0) > stored_updated_at
+
+def get_checkouts_full_updated_at(engine, ids, chunk_size=1000):
+    """Funcion para obtener el updated_at guardado de una lista de checkouts.
+    
+    Input : 
+    ---------
+      *  engine : SQLAlchemy.Engine. Instancia representativa de la base de datos. 
+      
+      *  ids : list. Lista de id_venta a consultar.
+      
+    Output :
+    ---------
+      * dict. id_venta -> updated_at (solo los checkouts que existen en la tabla).
+    """
+    stored = {}
+    with Session(engine) as session:
+        for i in range(0, len(ids), chunk_size):
+            rows = session.execute(select(checkouts_full.id_venta, checkouts_full.updated_at)
+                                   .where(checkouts_full.id_venta.in_(ids[i:i + chunk_size])))
+            for id_venta, updated_at in rows:
+                stored[id_venta] = updated_at
+    return stored
+
+def get_pending_billing_ids(engine, since):
+    """Funcion para obtener los checkouts cuya boleta aun no esta sincronizada.
+    
+    La boleta se emite despues de la venta sin cambiar el updatedAt del checkout,
+    por lo que estos checkouts se vuelven a descargar aunque no tengan cambios.
+    
+    Input : 
+    ---------
+      *  engine : SQLAlchemy.Engine. Instancia representativa de la base de datos. 
+      
+      *  since : datetime. Solo se consideran las ventas con fecha desde este instante.
+      
+    Output :
+    ---------
+      * list. id_venta con estado_boleta NULL o distinto de "synchronized".
+    """
+    with Session(engine) as session:
+        return list(session.scalars(
+            select(checkouts_full.id_venta)
+            .where(checkouts_full.fecha >= since)
+            .where((checkouts_full.estado_boleta == None) | (checkouts_full.estado_boleta != "synchronized"))
+        ))
 
 def writeCsvLog(CSV_FILE, level, description, message):
+    import pytz
     if not os.path.exists(CSV_FILE):
         with open(CSV_FILE, mode="w", newline="") as file:
             writer = csv.writer(file)
@@ -183,23 +275,12 @@ def writeCsvLog(CSV_FILE, level, description, message):
         writer = csv.writer(file)
         writer.writerow([time_now,level, description, message])
 
-def encrypt(data, key):
-    f = Fernet(key.encode())
-    encoded = data.encode()
-    return f.encrypt(encoded)
-
-def decrypt(encrypted, key):
-    f = Fernet(key.encode())
-    decrypted = f.decrypt(encrypted)
-    return decrypted.decode()
-
 def get_data_brands(token, merchant_id):
-    url = f"https://app.multivende.com/api/m/{merchant_id}/brands/p/1"
-    headers = {
-        'Authorization': f'Bearer {token}'
-    }
+    import pandas as pd
+    url = f"/api/m/{merchant_id}/brands/p/1"
+    client = get_client(token)
     
-    response = requests.request("GET", url, headers=headers)
+    response = client.get(url)
     
     try:
         response = response.json()
@@ -213,12 +294,11 @@ def get_data_brands(token, merchant_id):
     return brands
 
 def get_data_warranties(token, merchant_id):
-    url = f"https://app.multivende.com/api/m/{merchant_id}/warranties"    
-    headers = {
-            'Authorization': f'Bearer {token}'
-        }
+    import pandas as pd
+    url = f"/api/m/{merchant_id}/warranties"    
+    client = get_client(token)
 
-    response = requests.request("GET", url, headers=headers)
+    response = client.get(url)
     
     try:
         response = response.json()
@@ -232,42 +312,26 @@ def get_data_warranties(token, merchant_id):
     return warranties
 
 def get_data_tags(token, merchant_id):
-    url = f"https://app.multivende.com/api/m/{merchant_id}/tags/p/1"    
-    headers = {
-            'Authorization': f'Bearer {token}'
-        }
-    
-    response = requests.request("GET", url, headers=headers)
+    import pandas as pd
+    client = get_client(token)
     
     try:
-        response = response.json()
-    except:
-        logger.error(f"Error: {response.text}")
+        data = client.get_all_pages(f"/api/m/{merchant_id}/tags/p/{{page}}")
+    except Exception as e:
+        logger.error(f"Error: {e}")
         sys.exit()
         
-    if response['pagination']['total_pages'] > 1:
-        data = []
-        for i in range(response['pagination']['total_pages']):
-            url = f"https://app.multivende.com/api/m/{merchant_id}/tags/p/{i+1}"
-            response2 = requests.request("GET", url, headers=headers).json()
-            data += response2['entries']
-    else:
-        data = response['entries']
-        
     tags = pd.DataFrame(data)
-        
-    tags = pd.DataFrame(response["entries"])
     tags["type"] = "tag"
     tags = tags[["_id", "name", "type"]]
     return tags
 
 def get_data_colors(token, merchant_id):
-    url = f"https://app.multivende.com/api/m/{merchant_id}/colors/p/1"    
-    headers = {
-            'Authorization': f'Bearer {token}'
-        }
+    import pandas as pd
+    url = f"/api/m/{merchant_id}/colors/p/1"    
+    client = get_client(token)
 
-    response = requests.request("GET", url, headers=headers)
+    response = client.get(url)
     try:
         response = response.json()
     except:
@@ -280,47 +344,25 @@ def get_data_colors(token, merchant_id):
     return colors
 
 def get_data_categories(token, merchant_id):
-    url = f"https://app.multivende.com/api/m/{merchant_id}/product-categories/p/1"    
-    headers = {
-            'Authorization': f'Bearer {token}'
-        }
+    import pandas as pd
+    client = get_client(token)
     
-    response = requests.request("GET", url, headers=headers)
     try:
-        response = response.json()
-    except:
-        logger.error(f"Error: {response.text}")
+        data = client.get_all_pages(f"/api/m/{merchant_id}/product-categories/p/{{page}}")
+    except Exception as e:
+        logger.error(f"Error: {e}")
         sys.exit()
-    
-    pages = response["pagination"]["total_pages"]
-    data = []
-    for p in range(pages):
-        url = f"https://app.multivende.com/api/m/{merchant_id}/product-categories/p/{p+1}"
-        headers = {
-                'Authorization': f'Bearer {token}'
-            }
-        response = requests.request("GET", url, headers=headers)
-        
-        try:
-            response = response.json()
-        except:
-            logger.error(f"Error: {response.text}")
-            sys.exit()
         
-        df = pd.DataFrame(response["entries"])
-        data.append(df)
-        
-    cats = pd.concat(data, ignore_index=True)
+    cats = pd.DataFrame(data)
     cats["type"] = "category"
     cats = cats[["_id", "name", "type"]]
     return cats
 
 def get_data_size(token, merchant_id):
-    url = f"https://app.multivende.com/api/m/{merchant_id}/sizes/p/1"
-    headers = {
-            'Authorization': f'Bearer {token}'
-        }
-    response = requests.request("GET", url, headers=headers)
+    import pandas as pd
+    url = f"/api/m/{merchant_id}/sizes/p/1"
+    client = get_client(token)
+    response = client.get(url)
     
     try:
         response = response.json()
@@ -334,14 +376,13 @@ def get_data_size(token, merchant_id):
     return size
 
 def get_customs_attributes(token, merchant_id):
-    url1 = f"https://app.multivende.com/api/m/{merchant_id}/custom-attribute-sets/products"
-    #url1 = f"https://app.multivende.com/api/m/{merchant_id}/all-product-attributes"
-    url2 = f"https://app.multivende.com/api/m/{merchant_id}/custom-attribute-sets/product_versions"
-    headers = {
-            'Authorization': f'Bearer {token}'
-        }
-    response1 = requests.request("GET", url1, headers=headers)
-    response2 = requests.request("GET", url2, headers=headers)
+    import pandas as pd
+    url1 = f"/api/m/{merchant_id}/custom-attribute-sets/products"
+    #url1 = f"/api/m/{merchant_id}/all-product-attributes"
+    url2 = f"/api/m/{merchant_id}/custom-attribute-sets/product_versions"
+    client = get_client(token)
+    response1 = client.get(url1)
+    response2 = client.get(url2)
     try:
         response1 = response1.json()
     except:
@@ -418,8 +459,9 @@ def get_customs_attributes(token, merchant_id):
     data = pd.concat([dfv, dfp], ignore_index=True)
     return data
 
-def upload_data_products(df, Product, Attributes, engine):    
+def upload_data_products(df, Product, Attributes, engine, batch_size=UPSERT_BATCH_SIZE):
     # This two attribute columns are duplicated, remove one
+    import numpy as np
     try:
         df.drop(df.columns[df.columns.str.contains("Material del trípode")][1], axis=1, inplace=True)
     except:
@@ -433,112 +475,120 @@ def upload_data_products(df, Product, Attributes, engine):
     # Split dataframe by marketplaces and upload data to each one
     logger.info('Subiendo a la DB.')
     df = df.replace({np.nan: None})
+    rows, product_attributes = [], {}
+    for _, row in df.iterrows():
+        values = {column: row[field] for column, field in PRODUCTS_FIELDS.items()}
+        values['stock'] = 0
+        # Key/value de cada atributo del producto
+        atts = {name: value for name, value in row[23:-13].items() if value is not None}
+        # El hash incluye los atributos para detectar cambios solo en ellos
+        values['row_hash'] = row_hash({**values, 'attributes': atts})
+        rows.append(values)
+        product_attributes[(values['id_padre'], values['id_hijo'])] = {attribute_key(name, value)
+                                                                       for name, value in atts.items()}
+
+    counters = [0, 0, 0]
+    table = Product.__table__
+    key_columns = ["id_padre", "id_hijo"]
     try:
         with Session(engine) as session:
-            for id, row in df.iterrows():
-                # Get product data if exists
-                result = session.scalar(select(Product).where(Product.id_padre == row['IDENTIFICADOR_PADRE'] and 
-                                                              Product.id_hijo == row['IDENTIFICADOR_HIJO']))
-                # For each attribute of product check if key/value is in DB
-                atts = row[23:-13]
-                attributes = []
-                for i in atts[atts.notna()].index:
-                    # If is number create the correct object
-                    #print("Atts [i] ",atts[i], "\n")
-                    att_value = str(atts[i])
-                    if  att_value.replace('.', '').isdigit():
-                        attribute = Attributes(name = i, number_value = float(atts[i]))
-                        # Check if it's in DB
-                        exists_criteria = (select(Attributes.id)
-                                           .where(Attributes.name == attribute.name and 
-                                                  Attributes.number_value == attribute.number_value)
-                                           .exists())
-                        exists_att = session.scalar(select(exists_criteria)) 
-                        # Add the item to temporal list of attributes of the product
-                        attributes.append(attribute)
-                    else:
-                        attribute = Attributes(name = i, text_value = atts[i])
-                        # Check if it's in DB
-                        exists_criteria = (select(Attributes.id)
-                                           .where(Attributes.name == attribute.name and 
-                                                  Attributes.text_value == attribute.text_value)
-                                           .exists())
-                        exists_att = session.scalar(select(exists_criteria))
-                        # Add to the list of the product
-                        attributes.append(attribute)
-                    if exists_att:
-                        # Add the key/value attribute if it's not in DB
-                        session.add(attribute)
-                if result == None:
-                    # If new product, add it to DB
-                    new_product = Product(id_padre = row['IDENTIFICADOR_PADRE'], 
-                                          id_hijo= row['IDENTIFICADOR_HIJO'],
-                                          season = row['Season'],
-                                          model = row['model'],
-                                          description = row['description'],
-                                          htmlDescription = row['htmlDescription'],
-                                          shortDescription = row['shortDescription'],
-                                          htmlShortDescription = row['htmlShortDescription'],
-                                          warranty = row['Warranty'],
-                                          brand = row['Brand'],
-                                          name = row['name'],
-                                          productCategory = row['ProductCategory'],
-                                          skuName = row['sku_name'],
-                                          color = row['color'],
-                                          size = row['size'],
-                                          sku = row['sku'],
-                                          internalSku = row['internalSku'],
-                                          width = row['width'],
-                                          length = row['length'],
-                                          stock = 0,
-                                          height = row['height'],
-                                          weight = row['weight'],
-                                          tags = row['tags'],
-                                          picture = row['picture url'])
-                    for attribute in attributes:
-                        # Associate the attributes objects to the new product
-                        new_product.attributes.append(attribute)
-                    session.add(new_product)
-                else:
-                    # If the product exists, reset attributes links
-                    for i in range(len(result.attributes)):
-                        result.attributes.pop()
-                    # And a new ones (update)
-                    for attribute in attributes:
-                        result.attributes.append(attribute)
-                    # Update product info
-                    stmt = (update(Product)
-                                 .where(Product.id_padre == row['IDENTIFICADOR_PADRE'] and 
-                                        Product.id_hijo == row['IDENTIFICADOR_HIJO'])
-                                 .values(season = row['Season'],
-                                         model = row['model'],
-                                         description = row['description'],
-                                         htmlDescription = row['htmlDescription'],
-                                         shortDescription = row['shortDescription'],
-                                         htmlShortDescription = row['htmlShortDescription'],
-                                         warranty = row['Warranty'],
-                                         brand = row['Brand'],
-                                         name = row['name'],
-                                         productCategory = row['ProductCategory'],
-                                         skuName = row['sku_name'],
-                                         color = row['color'],
-                                         size = row['size'],
-                                         sku = row['sku'],
-                                         internalSku = row['internalSku'],
-                                         width = row['width'],
-                                         length = row['length'],
-                                         height = row['height'],
-                                         stock = 0,
-                                         weight = row['weight'],
-                                         tags = row['tags'],
-                                         picture = row['picture url']))
-                    session.execute(stmt)
-
+            conn = session.connection()
+            links = {}
+            for i in range(0, len(rows), batch_size):
+                # Upsert en lote sobre la llave unica (id_padre, id_hijo)
+                inserted, changed, unchanged = _split_changed_rows(conn, table, rows[i:i + batch_size], key_columns)
+                written = inserted + changed
+                if written:
+                    stmt = mysql_insert(table)
+                    stmt = stmt.on_duplicate_key_update({c: stmt.inserted[c] for c in written[0]
+                                                         if c not in key_columns})
+                    conn.execute(stmt, written)
+                    keys = [(row['id_padre'], row['id_hijo']) for row in written]
+                    stmt = (select(table.c.id, table.c.id_padre, table.c.id_hijo)
+                            .where(tuple_(table.c.id_padre, table.c.id_hijo).in_(keys)))
+                    for product_id, id_padre, id_hijo in conn.execute(stmt):
+                        links[product_id] = product_attributes[(id_padre, id_hijo)]
+                counters = [total + n for total, n in zip(counters, (len(inserted), len(changed), unchanged))]
+
+            attribute_ids = intern_attributes(session, Attributes, set().union(*links.values()),
+                                              load_attribute_ids(session, Attributes))
+            sync_product_attributes(session, {product_id: {attribute_ids[k] for k in keys}
+                                              for product_id, keys in links.items()})
             session.commit()
-        logger.info(f"Tabla 'Productos' populada con exito.")
+        logger.info("Tabla 'Productos' populada con exito. Rows inserted %d rows updated %d rows unchanged %d",
+                    *counters)
     except Exception as e:
         logger.error(f"La tabla 'Productos' tuvo un error {e}")
         sys.exit(0)
+    return tuple(counters)
+
+def attribute_key(name, value):
+    """
+    Retorna la llave (name, text_value, number_value) de un atributo.
+
+    Los valores numericos se guardan en number_value y el resto como texto. Los
+    numeros se redondean a 7 digitos significativos, la precision de un FLOAT de
+    MySQL, para que la llave calce con lo que retorna la base.
+    """
+    text = str(value)
+    if text.replace('.', '').isdigit():
+        return (name, None, float(f"{float(value):.7g}"))
+    return (name, text, None)
+
+def load_attribute_ids(session, Attributes):
+    """Carga en memoria todos los atributos como {attribute_key: id}."""
+    attribute_ids = {}
+    stmt = select(Attributes.id, Attributes.name, Attributes.text_value, Attributes.number_value)
+    for attribute_id, name, text_value, number_value in session.execute(stmt):
+        if text_value is None and number_value is not None:
+            key = (name, None, float(f"{number_value:.7g}"))
+        else:
+            key = (name, text_value, None)
+        attribute_ids.setdefault(key, attribute_id)
+    return attribute_ids
+
+def intern_attributes(session, Attributes, keys, attribute_ids):
+    """
+    Inserta en un solo lote los atributos de `keys` que no estan en `attribute_ids`
+    y actualiza el diccionario con sus ids.
+    """
+    missing = [k for k in keys if k not in attribute_ids]
+    if not missing:
+        return attribute_ids
+    session.execute(insert(Attributes), [{"name": name, "text_value": text_value, "number_value": number_value}
+                                         for name, text_value, number_value in missing])
+    attribute_ids.update(load_attribute_ids(session, Attributes))
+    logger.info(f"Atributos nuevos: {len(missing)}")
+    return attribute_ids
+
+def sync_product_attributes(session, links, chunk_size=1000):
+    """
+    Deja association_table igual a `links` ({id_product: set(id_atributo)}).
+
+    Carga los vinculos actuales de los productos con una consulta por bloque y
+    solo inserta o elimina la diferencia, en lote.
+    """
+    current = {product_id: set() for product_id in links}
+    product_ids = list(links)
+    for i in range(0, len(product_ids), chunk_size):
+        stmt = (select(association_table.c.id_product, association_table.c.id_atributo)
+                .where(association_table.c.id_product.in_(product_ids[i:i + chunk_size])))
+        for product_id, attribute_id in session.execute(stmt):
+            current[product_id].add(attribute_id)
+
+    to_insert, to_delete = [], []
+    for product_id, attribute_ids in links.items():
+        to_insert += [{"id_product": product_id, "id_atributo": a} for a in attribute_ids - current[product_id]]
+        to_delete += [{"key_product": product_id, "key_atributo": a} for a in current[product_id] - attribute_ids]
+    conn = session.connection()
+    if to_insert:
+        conn.execute(insert(association_table), to_insert)
+    if to_delete:
+        conn.execute(delete(association_table)
+                     .where(association_table.c.id_product == bindparam("key_product"))
+                     .where(association_table.c.id_atributo == bindparam("key_atributo")), to_delete)
+    logger.info(f"Vinculos producto-atributo: insertados {len(to_insert)} eliminados {len(to_delete)}")
+    return len(to_insert), len(to_delete)
 
 def check_diferences_and_update_deliverys(CSV_FILE, data, deliverys, engine):
     """Funcion para actualizacion de despachos.
@@ -554,48 +604,55 @@ def check_diferences_and_update_deliverys(CSV_FILE, data, deliverys, engine):
       
     Output :
     ---------
-      * None.
+      * tuple. (insertados, actualizados, sin cambios).
     """
-    updated_counter = 0
-    created_counter = 0
+    rows = [{column: row.get(field) for column, field in DELIVERYS_FIELDS.items()} for row in _records(data)]
+    inserted, changed = [], []
+    unchanged_counter = 0
 
-    # Check if the delivery is in the DB
     with Session(engine) as session:
-        for i, row in data.iterrows():
-            result = session.scalar(select(deliverys).where(deliverys.id_venta == row["id venta"] and 
-                                                              deliverys.n_venta == row["n venta"]))
-            # Add the new delivery to the DB
-            try:
-                if result == None:
-                    delivery = deliverys(n_seguimiento = row["N seguimiento"], codigo = row["codigo"],
-                                codigo_venta = row["codigo venta"], courier = row["courier"], clase_de_envio = row["clase de envio"],
-                                delivery_status = row["delivery status"], direccion = row["direccion"],
-                                impresion_etiqueta = row["estado impresion etiqueta"], fecha_despacho = row["fecha despacho"],
-                                fecha_promesa = row["fecha promesa"], id_venta = row["id venta"], 
-                                status_etiqueta = row["status etiqueta"], n_venta = row["n venta"])
-                    session.add(delivery)
-                    created_counter = created_counter + 1 
-                # update old values                         
+        try:
+            # Precarga en una consulta por bloque los hashes guardados de las llaves
+            keys = list({(row["id_venta"], row["n_venta"]) for row in rows})
+            existing = {}
+            for i in range(0, len(keys), 1000):
+                stmt = (select(deliverys.id_venta, deliverys.n_venta, deliverys.row_hash)
+                        .where(tuple_(deliverys.id_venta, deliverys.n_venta).in_(keys[i:i + 1000])))
+                for id_venta, n_venta, digest in session.execute(stmt):
+                    existing[(id_venta, n_venta)] = digest
+
+            # Solo se escriben los despachos nuevos o con cambios
+            for row in rows:
+                row["row_hash"] = row_hash(row)
+                key = (row["id_venta"], row["n_venta"])
+                if key not in existing:
+                    inserted.append(row)
+                elif existing[key] != row["row_hash"]:
+                    changed.append(row)
                 else:
-                    stmt = (
-                        update(deliverys)
-                        .where(deliverys.id_venta == row["id venta"] and 
-                            deliverys.n_venta == row["n venta"])
-                        .values(n_seguimiento = row["N seguimiento"], codigo = row["codigo"],
-                                codigo_venta = row["codigo venta"], courier = row["courier"], clase_de_envio = row["clase de envio"],
-                                delivery_status = row["delivery status"], direccion = row["direccion"],
-                                impresion_etiqueta = row["estado impresion etiqueta"], fecha_despacho = row["fecha despacho"],
-                                fecha_promesa = row["fecha promesa"], id_venta = row["id venta"], 
-                                status_etiqueta = row["status etiqueta"], n_venta = row["n venta"])
-                    )
-                    session.execute(stmt)
-                    updated_counter = updated_counter + 1
-            except Exception as e:
-                writeCsvLog(CSV_FILE, "ERROR", "DB loading error", f"The data load has failed {e}")
-                sys.exit(0)            
-        session.commit()
-        writeCsvLog(CSV_FILE, "INFO", "Upload info", f"Rows created {created_counter} Rows updated {updated_counter}")
-        logger.error(f"Rows created {created_counter} Rows updated {updated_counter}")
+                    unchanged_counter = unchanged_counter + 1
+                existing[key] = row["row_hash"]
+
+            if inserted:
+                session.execute(insert(deliverys), inserted)
+            if changed:
+                stmt = (
+                    update(deliverys)
+                    .where(deliverys.id_venta == bindparam("key_id_venta"))
+                    .where(deliverys.n_venta == bindparam("key_n_venta"))
+                    .values({column: bindparam(f"new_{column}") for column in changed[0]})
+                )
+                params = [{"key_id_venta": row["id_venta"], "key_n_venta": row["n_venta"],
+                           **{f"new_{column}": value for column, value in row.items()}} for row in changed]
+                session.connection().execute(stmt, params)
+            session.commit()
+        except Exception as e:
+            writeCsvLog(CSV_FILE, "ERROR", "DB loading error", f"The data load has failed {e}")
+            sys.exit(0)
+    message = f"Rows created {len(inserted)} Rows updated {len(changed)} Rows unchanged {unchanged_counter}"
+    writeCsvLog(CSV_FILE, "INFO", "Upload info", message)
+    logger.info(message)
+    return len(inserted), len(changed), unchanged_counter
 
 def check_difference_and_update_checkouts(CSV_FILE, data, checkouts, engine):
     """Funcion para actualizacion de ventas/checkouts.
@@ -622,7 +679,7 @@ def check_difference_and_update_checkouts(CSV_FILE, data, checkouts, engine):
         for i, row in data.iterrows():
             if row["nombre"] == None:
                 continue
-            result = session.scalar(select(checkouts).where(checkouts.id_venta == row["id"] and 
+            result = session.scalar(select(checkouts).where(checkouts.id_venta == row["id"],
                                                               checkouts.id_hijo_producto == row["id hijo producto"]))
             try:
             # Add the new checkout to the DB
@@ -642,7 +699,7 @@ def check_difference_and_update_checkouts(CSV_FILE, data, checkouts, engine):
                 else:
                     stmt = (
                         update(checkouts)
-                        .where(checkouts.id_venta == row["id"] and 
+                        .where(checkouts.id_venta == row["id"],
                             checkouts.id_hijo_producto == row["id hijo producto"])
                         .values(cantidad = row["cantidad"], codigo_producto = row["codigo producto"],
                                 costo_envio = row["costo de envio"], estado_boleta = row["estado boleta"],
@@ -663,224 +720,69 @@ def check_difference_and_update_checkouts(CSV_FILE, data, checkouts, engine):
         writeCsvLog(CSV_FILE, "INFO", "Upload info", f"Rows created {created_counter} Rows updated {updated_counter}")
         logger.error(f"Rows created {created_counter} Rows updated {updated_counter}")
 
-def check_difference_and_update_checkouts_full(data, checkouts_full, engine):
-    """Funcion para actualizacion de ventas/checkouts.
-    
-    Input : 
-    ---------
-      *  data : pandas.DataFrame. Tablas de datos con los checkouts a actualizar.
-      
-      *  checkouts : SQLAlchemy.Model. Objeto con el metadata de la tabla correspondiente a las 
-      ventas. Ver App/models/*.py para mas detalle sobre los modelos definidos..
-      
-      *  engine : SQLAlchemy.Engine. Instancia representativa de la base de datos. 
-      
-    Output :
-    ---------
-      * None.
-    """
-
-    updated_counter = 0
-    created_counter = 0
-
-    # Check if the checkout is in the DB
-    print("Cargando info...")
-    with Session(engine) as session:
-        print("Sesion iniciada..")
-        for i, row in data.iterrows():
-            if row["nombre"] == None:
-                continue
-            result = session.scalar(select(checkouts_full).where(checkouts_full.id_venta == row["id"]))
-            print("Base de datos consultada..")
-            try:
-            # Add the new checkout to the DB
-                if result == None:
-                    venta = checkouts_full(costo_envio = row["costo de envio"], estado_boleta = row["estado boleta"],
-                                estado_entrega = row["estado entrega"], estado_venta = row["estado venta"],
-                                fecha = row["fecha"],mail = row["mail"], 
-                                market = row["market"], n_venta = row["n venta"], 
-                                nombre_cliente = row["nombre"],
-                                phone = row["phone"],
-                                url_boleta = row["url boleta"],n_seguimiento = row["N seguimiento"], codigo = row["codigo"],
-                                codigo_venta = row["codigo venta"], courier = row["courier"], clase_de_envio = row["clase de envio"],
-                                delivery_status = row["delivery status"], direccion = row["direccion"],
-                                impresion_etiqueta = row["estado impresion etiqueta"], fecha_despacho = row["fecha despacho"],
-                                fecha_promesa = row["fecha promesa"], id_venta = row["id venta"], 
-                                status_etiqueta = row["status etiqueta"])
-                    session.add(venta)
-                    created_counter = created_counter + 1
-                    print("Creando item..") 
-                # Update the old values
-                else:
-                    stmt = (
-                        update(checkouts_full)
-                        .where(checkouts_full.id_venta == row["id"])
-                        .values(costo_envio = row["costo de envio"], estado_boleta = row["estado boleta"],
-                                estado_entrega = row["estado entrega"], estado_venta = row["estado venta"],
-                                fecha = row["fecha"],mail = row["mail"], 
-                                market = row["market"], n_venta = row["n venta"], 
-                                nombre_cliente = row["nombre"],
-                                phone = row["phone"],
-                                url_boleta = row["url boleta"],n_seguimiento = row["N seguimiento"], codigo = row["codigo"],
-                                codigo_venta = row["codigo venta"], courier = row["courier"], clase_de_envio = row["clase de envio"],
-                                delivery_status = row["delivery status"], direccion = row["direccion"],
-                                impresion_etiqueta = row["estado impresion etiqueta"], fecha_despacho = row["fecha despacho"],
-                                fecha_promesa = row["fecha promesa"], id_venta = row["id venta"], 
-                                status_etiqueta = row["status etiqueta"])
-                    )
-                    session.execute(stmt)
-                    updated_counter = updated_counter + 1
-                    print("Actualizando item..") 
-            except Exception as e:
-                print(e)
-                sys.exit(0)
-        session.commit()
-        print("Info cargada exitosamente...")
-        #writeCsvLog(CSV_FILE, "INFO", "Upload info", f"Rows created {created_counter} Rows updated {updated_counter}")
-        logger.error(f"Rows created {created_counter} Rows updated {updated_counter}")
-
-def check_difference_and_update_checkout_items(data, checkout_items, engine):
-    """Funcion para actualizacion de los items de los checkouts.
-    
-    Input : 
-    ---------
-      *  data : pandas.DataFrame. Tablas de datos con los checkouts a actualizar.
-      
-      *  checkouts : SQLAlchemy.Model. Objeto con el metadata de la tabla correspondiente a las 
-      ventas. Ver App/models/*.py para mas detalle sobre los modelos definidos..
-      
-      *  engine : SQLAlchemy.Engine. Instancia representativa de la base de datos. 
-      
-    Output :
-    ---------
-      * None.
+def _records(data):
+    """Normaliza un DataFrame o una lista de dicts a lista de dicts (NaN/NaT -> None)."""
+    if hasattr(data, "to_dict"):
+        return data.astype(object).where(data.notna(), None).to_dict("records")
+    return list(data)
+
+def _hash_value(value):
+    """Normaliza un valor para que el hash no dependa de su origen (pandas o dict)."""
+    if hasattr(value, "item") and not isinstance(value, (str, bytes)):
+        value = value.item()  # escalares numpy
+    if isinstance(value, datetime):
+        if value != value:  # NaT
+            return None
+        return value.replace(microsecond=0).isoformat(sep=" ")
+    if isinstance(value, float):
+        if value != value:  # NaN
+            return None
+        if value.is_integer():
+            return int(value)
+    return value
+
+def row_hash(values):
+    """Hash estable (sha1) de los campos mapeados de una fila, para detectar cambios."""
+    normalized = {k: _hash_value(v) for k, v in values.items() if k != "row_hash"}
+    payload = json.dumps(normalized, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+def _split_changed_rows(conn, table, rows, key_columns):
+    """Separa `rows` en (nuevas, con cambios, sin cambios) segun su row_hash.
+
+    Calcula el row_hash de las filas que no lo traen y precarga con una sola
+    consulta el hash guardado de las llaves del lote. Si una llave se repite en
+    el lote queda la ultima fila.
     """
+    latest = {}
+    for row in rows:
+        if not row.get("row_hash"):
+            row["row_hash"] = row_hash(row)
+        latest[tuple(row[c] for c in key_columns)] = row
+    key_cols = [table.c[c] for c in key_columns]
+    if len(key_cols) == 1:
+        existing_query = select(*key_cols, table.c.row_hash).where(key_cols[0].in_([k[0] for k in latest]))
+    else:
+        existing_query = select(*key_cols, table.c.row_hash).where(tuple_(*key_cols).in_(list(latest)))
+    existing = {tuple(r[:-1]): r[-1] for r in conn.execute(existing_query)}
 
-    updated_counter = 0
-    created_counter = 0
-
-    # Check if the checkout is in the DB
-    print("Cargando info...")
-    with Session(engine) as session:
-        print("Sesion iniciada para productos..")
-        for i, row in data.iterrows():
-            if row["nombre producto"] == None:
-                continue
-            result = session.scalar(select(checkout_items).where(checkout_items.id_venta == row["id venta"]).where(checkout_items.id_hijo_producto == row["id hijo producto"]))                
-            print("Base de datos consultada..")
-            try:
-            # Add the new checkout to the DB
-                if result == None:
-                    item = checkout_items(
-                                codigo_producto = row["codigo producto"],
-                                nombre_producto = row["nombre producto"],
-                                id_padre_producto = row["id padre producto"],
-                                id_hijo_producto = row["id hijo producto"],
-                                cantidad = row["cantidad"],
-                                precio = row["precio"],
-                                id_venta = row["id venta"]
-                                )
-                    session.add(item)
-                    created_counter = created_counter + 1
-                    print("Creando item..") 
-                # Update the old values
-                else:
-                    stmt = (
-                        update(checkout_items)
-                        .where(checkout_items.id_venta == row["id venta"])
-                        .where(checkout_items.id_hijo_producto == row["id hijo producto"])
-                        .values(
-                                codigo_producto = row["codigo producto"],
-                                nombre_producto = row["nombre producto"],
-                                id_padre_producto = row["id padre producto"],
-                                id_hijo_producto = row["id hijo producto"],
-                                cantidad = row["cantidad"], 
-                                precio = row["precio"],
-                                id_venta = row["id venta"]
-                                )
-                    )
-                    session.execute(stmt)
-                    updated_counter = updated_counter + 1
-                    print("Actualizando item..") 
-            except Exception as e:
-                writeCsvLog(CSV_FILE, "ERROR", "DB loading error", f"The data load has failed {e}")
-                sys.exit(0)
-        session.commit()
-        print("Info cargada exitosamente...")
-        #writeCsvLog(CSV_FILE, "INFO", "Upload info", f"Rows created {created_counter} Rows updated {updated_counter}")
-        logger.error(f"Rows created {created_counter} Rows updated {updated_counter}")
-
-def upsert_checkout_full(data, checkouts_full):
-    """Funcion para actualizar un item individual de checkouts.
-    
-    Input : 
-    ---------
-      *  data : pandas.DataFrame. Diccionario de datos con la informacion de checkout a actualizar.
+    inserted = [row for key, row in latest.items() if key not in existing]
+    changed = [row for key, row in latest.items() if key in existing and existing[key] != row["row_hash"]]
+    return inserted, changed, len(latest) - len(inserted) - len(changed)
 
-      *  engine : SQLAlchemy.Engine. Instancia representativa de la base de datos. 
+def _bulk_upsert(conn, table, rows, key_columns):
+    """Ejecuta un INSERT ... ON DUPLICATE KEY UPDATE (executemany) para `rows`.
 
-    Output :
-    ---------
-      * None.
+    Solo escribe las filas nuevas o cuyo hash cambio (ver _split_changed_rows).
+    Retorna (insertados, actualizados, sin cambios).
     """
-
-    engine = create_engine(SQLALCHEMY_DATABASE_URI,
-                        pool_recycle=3600,   # recycle connections every hour
-                        pool_pre_ping=True,
-                        connect_args={
-                            "ssl_ca": ssl
-                            }
-                        )
-
-    # Check if the checkout is in the DB
-    print("Cargando info...")
-    with Session(engine) as session:
-        result = session.scalar(select(checkouts_full).where(checkouts_full.id_venta == data["id venta"]))
-        print("Sesion iniciada para productos..")
-        try:
-        # Add the new checkout to the DB
-            print("Intentando...")
-            if result == None:
-                venta = checkouts_full(costo_envio = data["costo de envio"], estado_boleta = data["estado boleta"],
-                            estado_entrega = data["estado entrega"], estado_venta = data["estado venta"],
-                            fecha = data["fecha"],mail = data["mail"], 
-                            market = data["market"], n_venta = data["n venta"], 
-                            nombre_cliente = data["nombre"],
-                            phone = data["phone"],
-                            url_boleta = data["url boleta"], codigo = data["codigo"],
-                            codigo_venta = data["codigo venta"], courier = data["courier"], clase_de_envio = data["clase de envio"],
-                            delivery_status = data["delivery status"], direccion = data["direccion"],
-                            impresion_etiqueta = data["estado impresion etiqueta"], fecha_despacho = data["fecha despacho"],
-                            fecha_promesa = data["fecha promesa"], id_venta = data["id venta"], 
-                            status_etiqueta = data["status etiqueta"])
-                session.add(venta)
-                print("Creando item..") 
-            # Update the old values
-            else:
-                stmt = (
-                    update(checkouts_full)
-                    .where(checkouts_full.id_venta == data["id"])
-                    .values(costo_envio = data["costo de envio"], estado_boleta = data["estado boleta"],
-                            estado_entrega = data["estado entrega"], estado_venta = data["estado venta"],
-                            fecha = data["fecha"],mail = data["mail"], 
-                            market = data["market"], n_venta = data["n venta"], 
-                            nombre_cliente = data["nombre"],
-                            phone = data["phone"],
-                            url_boleta = data["url boleta"], codigo = data["codigo"],
-                            codigo_venta = data["codigo venta"], courier = data["courier"], clase_de_envio = data["clase de envio"],
-                            delivery_status = data["delivery status"], direccion = data["direccion"],
-                            impresion_etiqueta = data["estado impresion etiqueta"], fecha_despacho = data["fecha despacho"],
-                            fecha_promesa = data["fecha promesa"], id_venta = data["id venta"], 
-                            status_etiqueta = data["status etiqueta"])
-                )
-                session.execute(stmt)
-                print("Actualizando item..") 
-        except Exception as e:
-            print("Hubo un error ", e)
-            sys.exit(0)
-    session.commit()
-    print("Info cargada exitosamente...")
-    #writeCsvLog(CSV_FILE, "INFO", "Upload info", f"Rows created {created_counter} Rows updated {updated_counter}")
+    inserted, changed, unchanged = _split_changed_rows(conn, table, rows, key_columns)
+    if inserted or changed:
+        stmt = mysql_insert(table)
+        update_columns = [c for c in rows[0] if c not in key_columns]
+        stmt = stmt.on_duplicate_key_update({c: stmt.inserted[c] for c in update_columns})
+        conn.execute(stmt, inserted + changed)
+    return len(inserted), len(changed), unchanged
 
 def sync_product_with_ids(product_ids, Product, engine):
     """Funcion para sincronizar productos por lista de IDs realizando soft delete.
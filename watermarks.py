@@ -0,0 +1,55 @@
+"""
+watermarks.py — Watermarks de sincronización incremental
+
+Guarda por job el último instante hasta el cual la sincronización con
+Multivende terminó con éxito (tabla `sync_state`). Los jobs piden a la API solo
+lo actualizado desde ese punto, menos un pequeño solape para cubrir diferencias
+de reloj y escrituras tardías.
+"""
+
+import os
+import sys
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from models import sync_state
+
+SYNC_OVERLAP_MINUTES = int(os.getenv("SYNC_OVERLAP_MINUTES", "15"))
+
+
+def full_sync_requested() -> bool:
+    """True si se pidió re-sincronizar la ventana completa (`--full` o FULL_SYNC=1)."""
+    return "--full" in sys.argv or os.getenv("FULL_SYNC", "0") == "1"
+
+
+def get_watermark(engine, job):
+    """Retorna el watermark del job o None si nunca terminó una sincronización."""
+    with Session(engine) as session:
+        return session.scalar(select(sync_state.watermark).where(sync_state.job == job))
+
+
+def incremental_since(engine, job, overlap_minutes=SYNC_OVERLAP_MINUTES):
+    """
+    Retorna desde cuándo pedir cambios en modo incremental.
+
+    Es el watermark menos el solape configurado, o None si corresponde una
+    sincronización completa (forzada o sin watermark previo).
+    """
+    if full_sync_requested():
+        return None
+    watermark = get_watermark(engine, job)
+    if watermark is None:
+        return None
+    return watermark - timedelta(minutes=overlap_minutes)
+
+
+def set_watermark(engine, job, watermark):
+    """Registra el watermark del job luego de una sincronización exitosa."""
+    with Session(engine) as session:
+        state = session.get(sync_state, job)
+        if state is None:
+            session.add(sync_state(job=job, watermark=watermark, updated_at=datetime.now()))
+        else:
+            state.watermark = watermark
+            state.updated_at = datetime.now()
+        session.commit()
@@ -0,0 +1,447 @@
+"""
+webhook_queue.py — Cola durable (SQLite) para los webhooks de checkouts
+
+El endpoint `/load-checkout` solo guarda el ID del checkout en esta cola y
+responde 202; un pool de threads en segundo plano la drena descargando cada
+checkout de Multivende. Un evento que falla se reintenta con backoff
+exponencial y, si agota los intentos, pasa a la tabla `webhook_dead_letter`.
+
+La cola vive en un archivo SQLite local, por lo que sobrevive a reinicios del
+contenedor si el archivo está en un volumen. Varios workers de gunicorn pueden
+compartir el archivo: la toma de eventos se hace en una transacción
+`BEGIN IMMEDIATE` y cada evento queda bloqueado por un lease que se libera si
+el proceso muere a mitad de camino.
+
+Multivende envía varios webhooks seguidos para un mismo checkout (pago,
+etiqueta, despacho). La cola mantiene a lo más una fila por checkout: un evento
+que llega mientras su checkout espera en la cola se colapsa con él, y uno que
+llega mientras se procesa marca la fila para una sola recarga adicional al
+terminar. Un evento nuevo queda disponible recién tras WEBHOOK_DEBOUNCE_SECONDS,
+de modo que una ráfaga dentro de esa ventana se traduce en una sola recarga.
+
+Los workers solo descargan; un `BatchWriter` junta los checkouts descargados y
+los escribe en micro-lotes (por tamaño o tiempo) con un upsert por tabla.
+
+Variables de entorno:
+    WEBHOOK_QUEUE_PATH      archivo SQLite de la cola (default webhook_queue.db)
+    WEBHOOK_WORKERS         threads que drenan la cola por proceso (default 4)
+    WEBHOOK_MAX_ATTEMPTS    intentos antes de mover a dead letter (default 5)
+    WEBHOOK_RETRY_SECONDS   espera base entre reintentos, se duplica (default 5)
+    WEBHOOK_LEASE_SECONDS   tiempo tras el cual un evento tomado se libera (default 300)
+    WEBHOOK_DEBOUNCE_SECONDS ventana en que los eventos de un checkout se colapsan (default 2)
+    WEBHOOK_BATCH_SIZE      checkouts por lote de escritura (default 50)
+    WEBHOOK_BATCH_MS        espera máxima de un checkout antes de escribirse (default 500)
+"""
+
+import os
+import time
+import logging
+import sqlite3
+import threading
+import traceback
+
+logger = logging.getLogger(__name__)
+
+# --- Configuración ---
+WEBHOOK_QUEUE_PATH = os.getenv("WEBHOOK_QUEUE_PATH", "webhook_queue.db")
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "5"))
+WEBHOOK_RETRY_SECONDS = float(os.getenv("WEBHOOK_RETRY_SECONDS", "5"))
+WEBHOOK_LEASE_SECONDS = float(os.getenv("WEBHOOK_LEASE_SECONDS", "300"))
+WEBHOOK_DEBOUNCE_SECONDS = float(os.getenv("WEBHOOK_DEBOUNCE_SECONDS", "2"))
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "50"))
+WEBHOOK_BATCH_SECONDS = int(os.getenv("WEBHOOK_BATCH_MS", "500")) / 1000
+WEBHOOK_POLL_SECONDS = 0.5
+
+_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS webhook_queue (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        checkout_id TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        available_at REAL NOT NULL,
+        locked_at REAL,
+        locked_by TEXT,
+        last_error TEXT,
+        created_at REAL NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS ix_webhook_queue_available ON webhook_queue (available_at)",
+    "CREATE INDEX IF NOT EXISTS ix_webhook_queue_checkout ON webhook_queue (checkout_id)",
+    """CREATE TABLE IF NOT EXISTS webhook_dead_letter (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        checkout_id TEXT NOT NULL,
+        attempts INTEGER NOT NULL,
+        last_error TEXT,
+        created_at REAL NOT NULL,
+        failed_at REAL NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS webhook_metrics (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    )""",
+]
+
+# Columnas agregadas después de la primera versión del esquema
+_COLUMNS = {
+    "events": "INTEGER NOT NULL DEFAULT 1",
+    "rerun": "INTEGER NOT NULL DEFAULT 0",
+}
+
+# Contadores de webhook_metrics
+METRICS = ("received", "coalesced", "processed", "retried", "dead_letter")
+
+
+class WebhookQueue:
+    """
+    Cola FIFO persistente de IDs de checkout sobre SQLite.
+
+    Args:
+        path: archivo SQLite; se crea con su esquema si no existe.
+        max_attempts: intentos antes de mover un evento a dead letter.
+        retry_seconds: espera base de reintento (se duplica por intento).
+        lease_seconds: segundos tras los que un evento tomado vuelve a la cola.
+        debounce_seconds: espera antes de procesar un checkout recién encolado.
+    """
+
+    def __init__(self, path=WEBHOOK_QUEUE_PATH, max_attempts=WEBHOOK_MAX_ATTEMPTS,
+                 retry_seconds=WEBHOOK_RETRY_SECONDS, lease_seconds=WEBHOOK_LEASE_SECONDS,
+                 debounce_seconds=WEBHOOK_DEBOUNCE_SECONDS):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.retry_seconds = retry_seconds
+        self.lease_seconds = lease_seconds
+        self.debounce_seconds = debounce_seconds
+        self._local = threading.local()
+        self._pid = os.getpid()
+        # El esquema se crea con una conexión propia que no queda cacheada
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            for statement in _SCHEMA:
+                conn.execute(statement)
+            existing = {row[1] for row in conn.execute("PRAGMA table_info(webhook_queue)")}
+            for column, definition in _COLUMNS.items():
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE webhook_queue ADD COLUMN {column} {definition}")
+            conn.executemany("INSERT OR IGNORE INTO webhook_metrics (name) VALUES (?)", [(m,) for m in METRICS])
+        finally:
+            conn.close()
+
+    def _conn(self):
+        # Una conexión por thread y por proceso: tras un fork el hijo no reutiliza
+        # las conexiones heredadas del padre. Autocommit salvo en las transacciones
+        # explícitas
+        if self._pid != os.getpid():
+            self._local = threading.local()
+            self._pid = os.getpid()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA busy_timeout=30000")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self, fn):
+        """Ejecuta `fn(conn)` dentro de BEGIN IMMEDIATE ... COMMIT."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return result
+
+    @staticmethod
+    def _count(conn, metric, n=1):
+        conn.execute("UPDATE webhook_metrics SET value = value + ? WHERE name = ?", (n, metric))
+
+    def enqueue(self, checkout_id):
+        """
+        Agrega un evento a la cola, colapsándolo si el checkout ya está encolado
+        o en proceso. Retorna (id del evento, True si se colapsó).
+        """
+        now = time.time()
+
+        def _enqueue(conn):
+            self._count(conn, "received")
+            row = conn.execute("SELECT id, locked_at FROM webhook_queue WHERE checkout_id = ? LIMIT 1",
+                               (checkout_id,)).fetchone()
+            if row is None:
+                cursor = conn.execute(
+                    "INSERT INTO webhook_queue (checkout_id, available_at, created_at) VALUES (?, ?, ?)",
+                    (checkout_id, now + self.debounce_seconds, now))
+                return cursor.lastrowid, False
+            event_id, locked_at = row
+            if locked_at is not None and locked_at >= now - self.lease_seconds:
+                # En proceso: los datos leídos pueden ser previos al evento, recargar al terminar
+                conn.execute("UPDATE webhook_queue SET events = events + 1, rerun = 1 WHERE id = ?", (event_id,))
+            else:
+                conn.execute("UPDATE webhook_queue SET events = events + 1 WHERE id = ?", (event_id,))
+            self._count(conn, "coalesced")
+            return event_id, True
+
+        return self._transaction(_enqueue)
+
+    def claim(self, worker):
+        """
+        Toma el evento disponible más antiguo y lo bloquea para `worker`.
+
+        Retorna (id, checkout_id, attempts) o None si no hay eventos listos.
+        """
+        now = time.time()
+
+        def _claim(conn):
+            row = conn.execute(
+                """SELECT id, checkout_id, attempts FROM webhook_queue
+                   WHERE available_at <= ? AND (locked_at IS NULL OR locked_at < ?)
+                   ORDER BY available_at, id LIMIT 1""",
+                (now, now - self.lease_seconds)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE webhook_queue SET locked_at = ?, locked_by = ?, rerun = 0 WHERE id = ?",
+                             (now, worker, row[0]))
+            return row
+
+        return self._transaction(_claim)
+
+    def ack(self, event_id):
+        """
+        Marca un evento como procesado. Si llegaron eventos del mismo checkout
+        durante el proceso, lo reprograma para una única recarga más.
+        """
+        now = time.time()
+
+        def _ack(conn):
+            self._count(conn, "processed")
+            rerun = conn.execute("SELECT rerun FROM webhook_queue WHERE id = ?", (event_id,)).fetchone()
+            if rerun and rerun[0]:
+                conn.execute(
+                    """UPDATE webhook_queue SET available_at = ?, locked_at = NULL, locked_by = NULL,
+                       attempts = 0, rerun = 0, events = 1 WHERE id = ?""",
+                    (now + self.debounce_seconds, event_id))
+            else:
+                conn.execute("DELETE FROM webhook_queue WHERE id = ?", (event_id,))
+
+        self._transaction(_ack)
+
+    def fail(self, event_id, error):
+        """
+        Registra un intento fallido. Reprograma el evento con backoff exponencial
+        o lo mueve a dead letter si agotó los intentos. Retorna True si fue a
+        dead letter.
+        """
+        now = time.time()
+
+        def _fail(conn):
+            row = conn.execute("SELECT checkout_id, attempts, created_at FROM webhook_queue WHERE id = ?",
+                               (event_id,)).fetchone()
+            if row is None:
+                return False
+            checkout_id, attempts, created_at = row
+            attempts += 1
+            if attempts >= self.max_attempts:
+                conn.execute(
+                    """INSERT INTO webhook_dead_letter (checkout_id, attempts, last_error, created_at, failed_at)
+                       VALUES (?, ?, ?, ?, ?)""", (checkout_id, attempts, error, created_at, now))
+                conn.execute("DELETE FROM webhook_queue WHERE id = ?", (event_id,))
+                self._count(conn, "dead_letter")
+                return True
+            delay = self.retry_seconds * 2 ** (attempts - 1)
+            conn.execute(
+                """UPDATE webhook_queue SET attempts = ?, available_at = ?, locked_at = NULL,
+                   locked_by = NULL, last_error = ? WHERE id = ?""",
+                (attempts, now + delay, error, event_id))
+            self._count(conn, "retried")
+            return False
+
+        return self._transaction(_fail)
+
+    def stats(self):
+        """Eventos pendientes, en proceso y en dead letter, más los contadores acumulados."""
+        conn = self._conn()
+        now = time.time()
+        pending, processing = conn.execute(
+            """SELECT COALESCE(SUM(locked_at IS NULL OR locked_at < ?), 0),
+                      COALESCE(SUM(locked_at IS NOT NULL AND locked_at >= ?), 0)
+               FROM webhook_queue""", (now - self.lease_seconds, now - self.lease_seconds)).fetchone()
+        dead = conn.execute("SELECT COUNT(*) FROM webhook_dead_letter").fetchone()[0]
+        metrics = dict(conn.execute("SELECT name, value FROM webhook_metrics").fetchall())
+        return {"pending": pending, "processing": processing, "dead_letter": dead, "metrics": metrics}
+
+
+def _record_failure(queue, event_id, checkout_id, attempts, error):
+    """Registra un intento fallido de un evento y lo informa en el log."""
+    if queue.fail(event_id, error):
+        logger.error("Checkout %s a dead letter tras %d intentos: %s", checkout_id, attempts + 1, error)
+    else:
+        logger.warning("Checkout %s fallo (intento %d), se reintentara: %s", checkout_id, attempts + 1, error)
+
+
+class BatchWriter:
+    """
+    Acumula resultados de los workers y los escribe en micro-lotes.
+
+    Un lote se escribe con `write(results)` al juntar `batch_size` resultados o
+    cuando el más antiguo lleva `flush_seconds` esperando. Los eventos del lote
+    se confirman en la cola solo después de escribirlo. Si la escritura del lote
+    falla, cada resultado se escribe por separado: se confirman los que se
+    escriben y solo los que fallan cuentan como intento fallido.
+
+    Args:
+        queue: WebhookQueue de la que vienen los eventos.
+        write: función que recibe la lista de resultados de un lote.
+        batch_size: resultados por lote.
+        flush_seconds: espera máxima de un resultado antes de escribirse.
+    """
+
+    def __init__(self, queue, write, batch_size=WEBHOOK_BATCH_SIZE, flush_seconds=WEBHOOK_BATCH_SECONDS):
+        self.queue = queue
+        self.write = write
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.batches = 0
+        self._pending = []
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def start(self):
+        """Arranca el thread de escritura; idempotente y seguro tras un fork."""
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        self._pid = os.getpid()
+        self._stop.clear()
+        self._pending = []
+        self._thread = threading.Thread(target=self._run, name="webhook-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def add(self, event_id, checkout_id, attempts, result):
+        """Encola un resultado para el próximo lote. Bloquea si hay demasiados pendientes."""
+        with self._cond:
+            while len(self._pending) >= self.batch_size * 4 and not self._stop.is_set():
+                self._cond.wait(self.flush_seconds)
+            self._pending.append((time.monotonic(), event_id, checkout_id, attempts, result))
+            self._cond.notify_all()
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._pending and not self._stop.is_set():
+                self._cond.wait(WEBHOOK_POLL_SECONDS)
+            if not self._pending:
+                return []
+            deadline = self._pending[0][0] + self.flush_seconds
+            while len(self._pending) < self.batch_size and not self._stop.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch, self._pending = self._pending[:self.batch_size], self._pending[self.batch_size:]
+            self._cond.notify_all()
+            return batch
+
+    def _run(self):
+        while not (self._stop.is_set() and not self._pending):
+            batch = self._next_batch()
+            if batch:
+                self.flush(batch)
+
+    def flush(self, batch):
+        try:
+            self.write([result for _, _, _, _, result in batch])
+        except BaseException as e:
+            logger.debug(traceback.format_exc())
+            logger.error("Fallo la escritura de un lote de %d checkouts, se escriben por separado: %s",
+                         len(batch), f"{type(e).__name__}: {e}")
+            self._flush_each(batch)
+            return
+        for _, event_id, _, _, _ in batch:
+            self.queue.ack(event_id)
+        self.batches += 1
+        logger.info("Lote de %d checkouts escrito", len(batch))
+
+    def _flush_each(self, batch):
+        # Aisla los checkouts que no se pueden escribir para no reintentar el lote completo
+        for _, event_id, checkout_id, attempts, result in batch:
+            try:
+                self.write([result])
+            except BaseException as e:
+                logger.debug(traceback.format_exc())
+                _record_failure(self.queue, event_id, checkout_id, attempts, f"{type(e).__name__}: {e}")
+                continue
+            self.queue.ack(event_id)
+
+
+class WebhookWorkers:
+    """
+    Pool de threads que drena una WebhookQueue aplicando `handler(checkout_id)`.
+
+    Un evento se da por procesado si `handler` no lanza excepción; cualquier
+    excepción (incluido SystemExit de las funciones de utils.py) cuenta como
+    intento fallido. Si se entrega un `writer` (BatchWriter), el resultado de
+    `handler` se le pasa para escribirse en lote y el evento se confirma al
+    escribirse el lote.
+    """
+
+    def __init__(self, queue, handler, workers=WEBHOOK_WORKERS, poll_seconds=WEBHOOK_POLL_SECONDS,
+                 writer=None):
+        self.queue = queue
+        self.handler = handler
+        self.workers = workers
+        self.poll_seconds = poll_seconds
+        self.writer = writer
+        self._stop = threading.Event()
+        self._threads = []
+        self._pid = None
+
+    def start(self):
+        """Arranca los threads; es idempotente y vuelve a arrancarlos tras un fork."""
+        if self._pid == os.getpid() and any(t.is_alive() for t in self._threads):
+            return
+        self._pid = os.getpid()
+        self._stop.clear()
+        if self.writer is not None:
+            self.writer.start()
+        self._threads = [threading.Thread(target=self._run, name=f"webhook-worker-{i}", daemon=True)
+                         for i in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+        logger.info("Webhook workers iniciados: %d (pid %d)", self.workers, self._pid)
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        if self.writer is not None:
+            self.writer.stop(timeout)
+
+    def _run(self):
+        worker = f"{os.getpid()}-{threading.current_thread().name}"
+        while not self._stop.is_set():
+            try:
+                event = self.queue.claim(worker)
+            except sqlite3.Error as e:
+                logger.error("Error leyendo la cola de webhooks: %s", e)
+                event = None
+            if event is None:
+                self._stop.wait(self.poll_seconds)
+                continue
+            event_id, checkout_id, attempts = event
+            try:
+                result = self.handler(checkout_id)
+            except BaseException as e:
+                logger.debug(traceback.format_exc())
+                _record_failure(self.queue, event_id, checkout_id, attempts, f"{type(e).__name__}: {e}")
+                continue
+            if self.writer is not None:
+                self.writer.add(event_id, checkout_id, attempts, result)
+            else:
+                self.queue.ack(event_id)